@@ -1,122 +1,771 @@
 #%% Imports
 # Built-in
-import os, sys, re
+import os, sys, re, time, json, gzip, base64, hashlib, unicodedata
+import http.client
+from urllib.parse import urlsplit
+from contextlib import contextmanager
+from collections.abc import Iterable, Iterator
 
-# Anki
-from anki.storage import Collection
-from anki.notes import Note
+# Internal modules
+from internal_globals import CPATH, MPATH, FAKE_CPATH, IMG_PREFIX, ANKI_BACKEND, DEFAULT_CSS
+from fake_anki import FakeCollection
 
-from anki.decks import DeckManager
-from anki.models import ModelManager
-from anki.tags import TagManager
+# Anki
+try:
+    from anki.storage import Collection
+    from anki.collection import AddNoteRequest
+    from anki.notes import Note
+    from anki.utils import base91
+except ImportError:
+    if ANKI_BACKEND != "fake": # Only fall back to the stand-in if it was asked for, e.g., in CI
+        raise
+    from fake_anki import FakeCollection as Collection, AddNoteRequest, Note, base91
 
-# Internal modules
-from internal_globals import CPATH
+#%% Constants
+IMG_NAME_RE = re.compile(RF"^{re.escape(IMG_PREFIX)}\w+\.png$") # Naming scheme of images written by renderer._renderImage
+COMPACT_MODEL = "OneNote Auto" # Note type for compact (class styled) cards, created by ensureNoteType()
+CONTEXT_MODEL = "OneNote Auto Context" # Note type for inline styled cards with context in its own field, created by ensureNoteType()
+FIELDS_CONTEXT = ["Front", "Back", "Context"] # Fields of note types created by ensureNoteType()
+QFMT_CONTEXT = "{{Context}}{{Front}}" # Card templates of note types created by ensureNoteType()
+AFMT_CONTEXT = "{{FrontSide}}\n\n<hr id=answer>\n\n{{Context}}{{Back}}" # Same layout as Basic with context on both sides
+IMG_SRC_RE = re.compile(R"<img[^>]*?src=[\"']([^\"']+)[\"']") # Captures media filename referenced by an image tag
+PROGRESS_INTERVAL = 1.0 # Min seconds between progress messages during bulk operations
+ADD_BATCH = 1000 # Notes added per transaction by addCardsFromNotes()
+ANKICONNECT_URL = "http://127.0.0.1:8765" # Default address of the AnkiConnect add-on
+ANKICONNECT_VERSION = 6
+ANKICONNECT_BATCH = 500 # Notes or media files per request
+ANKICONNECT_IDEMPOTENT = {"version", "modelNames", "deckNames", "findNotes", "createDeck", "storeMediaFile", "updateModelStyling"} # Safe to resend if response was lost
+NOTE_STREAM_VERSION = 1 # Format of streams written by NoteStreamWriter, readers reject newer versions
 
 #%% Classes
 class ProtoNote:
     
-    def __init__(self, front, back, deck = "Default", model = "Basic", tags = None) -> None:
+    def __init__(self, front, back, deck = "Default", model = "Basic", tags = None, context = "", guid = None) -> None:
         self.front: str = front
         self.back: str = back
+        self.context: str = context # Shared by front and back, only stored if note type has a Context field
         self.tags: list[str] = tags
         self.deck = deck 
         self.model = model 
+        self.guid: str | None = guid # Stable Anki note GUID, see noteGuid(). Random if None or already taken when adding
+
+class _Progress:
+    """
+    Prints progress of a bulk operation at most once every PROGRESS_INTERVAL seconds and once at completion
+    total: None if unknown, e.g., for notes which are still being generated. Progress is then printed without total
+    """
+    
+    def __init__(self, total: int | None = None, verb: str = "Processed") -> None:
+        self.total = total
+        self.verb = verb
+        self.count = 0
+        self.last_print = time.monotonic()
+    
+    def update(self, count: int = 1):
+        self.count += count
+        now = time.monotonic()
+        if self.total == None: # Completion isn't known in advance
+            if now - self.last_print >= PROGRESS_INTERVAL:
+                print(f"{self.verb} {self.count} cards")
+                self.last_print = now
+        elif self.count >= self.total or now - self.last_print >= PROGRESS_INTERVAL:
+            print(f"{self.verb} {self.count}/{self.total} cards")
+            self.last_print = now
+
+class SyncPlan:
+    """
+    Changes needed to bring auto notes in line with generated notes, see planSync()
+    """
+    
+    def __init__(self) -> None:
+        self.adds: list[tuple[ProtoNote, int | None, dict | None, list[str] | None]] = [] # (note, deck id, note type, fields)
+        self.updates: list[tuple[int, ProtoNote, list[str]]] = [] # (note id, note, fields)
+        self.moves: dict[int, list[int]] = {} # Deck id -> ids of notes to move there
+        self.removals: list[int] = [] # Note ids
+        self.unchanged = 0
+    
+    def isEmpty(self) -> bool:
+        return not (self.adds or self.updates or self.moves or self.removals)
+    
+    def __str__(self) -> str:
+        return (F"Add {len(self.adds)} | Update {len(self.updates)} | Move {sum(len(n) for n in self.moves.values())} | "
+                F"Remove {len(self.removals)} | Unchanged {self.unchanged}")
+
+class AnkiConnect:
+    """
+    Client for an AnkiConnect-compatible HTTP API, so that cards can be added while Anki is open (which locks the collection)
+    All requests go through one keep-alive connection. If it was dropped while idle, a request is only resent
+    if it never went out or its action is in ANKICONNECT_IDEMPOTENT, so that notes are never added twice
+    """
+    
+    def __init__(self, url: str = ANKICONNECT_URL, timeout: float = 60) -> None:
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self._conn: http.client.HTTPConnection | None = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def invoke(self, action: str, **params):
+        """
+        Sends a single action and returns its result, raises RuntimeError if the API returns an error
+        """
+        body = json.dumps({"action": action, "version": ANKICONNECT_VERSION, "params": params}).encode("utf-8")
+        idempotent = action in ANKICONNECT_IDEMPOTENT or (action == "multi" and
+                                                           all(a["action"] in ANKICONNECT_IDEMPOTENT for a in params["actions"]))
+        for attempt in range(2): # Server may have dropped an idle connection, retry once on a new one
+            reused = self._conn is not None
+            if not reused:
+                self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self._conn.request("POST", "/", body, {"Content-Type": "application/json"})
+            except (http.client.HTTPException, ConnectionError): # Request didn't go out, always safe to resend
+                self.close()
+                if attempt or not reused:
+                    raise
+                continue
+            try:
+                response = json.loads(self._conn.getresponse().read())
+                break
+            except (http.client.HTTPException, ConnectionError): # Server may have handled request already, e.g., added notes
+                self.close()
+                if attempt or not reused or not idempotent:
+                    raise
+        if response.get("error"):
+            raise RuntimeError(F"AnkiConnect {action}: {response['error']}")
+        return response["result"]
+    
+    def multi(self, actions: list[tuple[str, dict]]) -> list:
+        """
+        Sends several (action, params) in one request, returns their results in order
+        """
+        results = self.invoke("multi", actions=[{"action": action, "version": ANKICONNECT_VERSION, "params": params}
+                                                for action, params in actions])
+        for (action, params), result in zip(actions, results):
+            if result.get("error"):
+                raise RuntimeError(F"AnkiConnect {action}: {result['error']}")
+        return [result["result"] for result in results]
+    
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+class NoteStreamWriter:
+    """
+    Writes notes into a JSONL stream which is imported separately by addCardsFromStreams(), e.g., after generating on other machines
+    First line is a header with the format version and note type styling. Each image referenced by a note is written once
+    as a base64 media line before the first note using it, so that streams are self-contained. Paths ending in .gz are gzipped
+    media_files, media_dir: Where images are looked up, see referencedMedia(). media_dir defaults to MPATH
+    note_css: Note types to create or update on import, maps note type name to its CSS
+    """
+    def __init__(self, stream_path: str | os.PathLike, media_files: dict[str, bytes] | None = None,
+                 media_dir: str | os.PathLike | None = None, note_css: dict[str, str] | None = None):
+        self.stream_path = stream_path
+        self.media_files = media_files if media_files is not None else {} # Same dict as the sink, which is still filled while notes render
+        self.media_dir = media_dir or MPATH
+        self.note_count = 0
+        self._media_names: set[str] = set() # Images already written
+        self._file = _openStream(stream_path, "w")
+        self._writeRecord({"type": "header", "version": NOTE_STREAM_VERSION, "note_css": note_css or {}})
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def write(self, note: ProtoNote):
+        for src, data in referencedMedia([note], self.media_files, self.media_dir).items():
+            if src in self._media_names:
+                continue
+            self._media_names.add(src)
+            if not isinstance(data, bytes): # Path of image in media_dir
+                with open(data, "rb") as file:
+                    data = file.read()
+            self._writeRecord({"type": "media", "name": src, "data": base64.b64encode(data).decode("ascii")})
+        self._writeRecord({"type": "note", "front": note.front, "back": note.back, "context": note.context, "deck": note.deck,
+                           "model": note.model, "tags": sorted(note.tags or []), "guid": note.guid}) # Tags can be a set of flags
+        self.note_count += 1
+    
+    def close(self):
+        self._file.close()
+    
+    def _writeRecord(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
 
 #%%
 
-def addCardsFromNotes(notes: list[ProtoNote],
+@contextmanager
+def openCollection(col_open: Collection | bool = False):
+    """
+    Yields col_open if it is an already open collection, otherwise opens the collection at CPATH and closes it on exit
+    Opening loads the backend and checks the DB schema, so a whole run should share one session:
+    with openCollection() as col:
+        addCardsFromNotes(notes, col_open=col)
+        reportCollection(col)
+    col_open may also be a fake_anki.FakeCollection, which is opened by default at FAKE_CPATH (in memory unless ANKI_CPATH is set)
+    if ANKI_BACKEND is "fake"
+    """
+    if col_open: # Owned by caller, who is responsible for closing it
+        yield col_open
+        return
+    if ANKI_BACKEND == "fake":
+        col = FakeCollection(FAKE_CPATH)
+    else:
+        col = Collection(CPATH)
+    try: # Should always close, otherwise anki will get stuck
+        yield col
+    finally:
+        col.close()
+
+def addCardsFromNotes(notes: Iterable[ProtoNote],
                       deck_name: str = None,
                       card_type: str = None,
-                      replace = False):
-    try: # Open Anki DB using try statement so that any errors during the process will not interrupt Python from closing DB
-        col = Collection(CPATH) # Open collection
-        
-        if replace: # Remove all auto cards from target decks
-            target_decks: set[str] = {n.deck for n in notes}
-            if deck_name:
-                target_decks.add(deck_name)
+                      replace = False,
+                      note_css: dict[str, str] | None = None,
+                      report = False,
+                      col_open: Collection | bool = False,
+                      media: dict[str, bytes] | None = None,
+                      release_media = False):
+    """
+    notes: Added in batches of ADD_BATCH as they come in, so they can be a generator which is still rendering
+    replace: Remove auto cards from each target deck (and its subdecks) before the first note for it is added,
+    notes added earlier in the run are kept, e.g., in a subdeck whose notes came before its parent deck's
+    Notes whose GUID is already taken (e.g., when adding twice without replace) get a random one, see syncCardsFromNotes()
+    note_css: Note types to create or update before adding notes, maps note type name to its CSS
+    report: Print card counts per deck once all notes are added
+    media: Images referenced by notes to register before adding notes, maps filename to data, see registerMedia()
+    Each image is registered once, with the first batch referencing it
+    release_media: Remove images from media once registered so their data isn't held until the end, only if media isn't read elsewhere
+    """
+    with openCollection(col_open) as col:
+        for model_name, css in (note_css or {}).items():
+            ensureNoteType(col, model_name, css)
+        
+        cleared_decks: set[str] = set() # Target decks which auto cards were already removed from
+        added_nids: set[int] = set() # Deck searches include subdecks, which may already have new notes
+        used_guids: set[str] = set(col.db.list("select guid from notes")) # Single query instead of a lookup per note
+        registered: set[str] = set() # Images already registered, may be referenced again by later batches
+        renamed: dict[str, str] = {} # Of all registered images, since their data may have been released
+        added: dict[int, int] = {} # Deck id -> number of cards added
+        progress = _Progress(verb="Added")
+        
+        def addBatch(batch: list[ProtoNote]):
+            if replace: 
+                target_decks = {n.deck for n in batch} | ({deck_name} if deck_name else set())
+                target_decks -= cleared_decks
+                if target_decks:
+                    deck_filter = " OR ".join(F'"deck:{targ_deck}"' for targ_deck in target_decks)
+                    old_nids = [nid for nid in col.find_notes(F'tag:Auto ({deck_filter})') if nid not in added_nids] # All new target decks at once
+                    if old_nids: # Their GUIDs can be reused by the notes replacing them
+                        used_guids.difference_update(col.db.list(F"select guid from notes where id in ({','.join(map(str, old_nids))})"))
+                    col.remove_notes(old_nids)
+                    print(F"Removed {len(old_nids)} cards")
+                    cleared_decks.update(target_decks)
+            batch_media = referencedMedia(batch, media) if media else {} # Rest may still be rendering
+            new_media = {fname: data for fname, data in batch_media.items() if fname not in registered}
+            if new_media:
+                renamed.update(registerMedia(new_media, col))
+                registered.update(new_media)
+            if release_media:
+                for fname in batch_media:
+                    del media[fname]
             
-            for targ_deck in target_decks:
-                remCards(F'tag:Auto "deck:{targ_deck}"', col) # Remove auto cards from target deck
+            requests: dict[int, list[AddNoteRequest]] = {} # Notes grouped by deck id
+            for note, (deck_id, model, fields) in zip(batch, _resolveNotes(col, batch, deck_name, card_type, renamed=renamed)):
+                anki_note = _newAnkiNote(col, note, model, fields, used_guids) # Isn't added to collection until batch insertion
+                requests.setdefault(deck_id, []).append(AddNoteRequest(anki_note, deck_id))
+            for deck_id, deck_requests in requests.items(): # Each call is a single DB transaction and undo step
+                col.add_notes(deck_requests) # Sets ids of notes
+                added[deck_id] = added.get(deck_id, 0) + len(deck_requests)
+                if replace:
+                    added_nids.update(request.note.id for request in deck_requests)
+            progress.update(len(batch))
+        
+        for batch in _batched(notes, ADD_BATCH):
+            addBatch(batch)
+        
+        for deck_id, count in added.items():
+            print(f"Added {count} cards to {col.decks.name(deck_id)}")
+        
+        if replace: # Images of removed notes are left behind in media folder otherwise
+            remOrphanMedia(col)
+        
+        if report:
+            reportCollection(col)
+
+def syncCardsFromNotes(notes: list[ProtoNote],
+                       deck_name: str = None,
+                       card_type: str = None,
+                       note_css: dict[str, str] | None = None,
+                       col_open: Collection | bool = False,
+                       media: dict[str, bytes] | None = None) -> "SyncPlan":
+    """
+    Brings auto notes in target decks in line with notes without touching unchanged notes, keeping their review history
+    Existing notes are matched by GUID, only notes whose fields, tags, deck or note type differ are written
+    Auto notes in target decks which no longer have a counterpart in notes are removed
+    note_css: Note types to create or update before syncing, maps note type name to its CSS
+    media: Images referenced by notes, see registerMedia()
+    """
+    with openCollection(col_open) as col:
+        renamed = registerMedia(media, col) if media else {}
+        for model_name, css in (note_css or {}).items():
+            ensureNoteType(col, model_name, css)
+        
+        plan = planSync(col, notes, deck_name, card_type, renamed=renamed)
+        
+        if plan.removals:
+            col.remove_notes(plan.removals)
+        if plan.updates:
+            updates = []
+            for nid, note, fields in plan.updates:
+                anki_note = col.get_note(nid) # Only changed notes are loaded
+                anki_note.fields = fields
+                anki_note.tags = _noteTags(note)
+                updates.append(anki_note)
+            col.update_notes(updates)
+        for deck_id, nids in plan.moves.items():
+            col.set_deck([cid for nid in nids for cid in col.card_ids_of_note(nid)], deck_id)
+        requests: dict[int, list[AddNoteRequest]] = {} # New notes grouped by deck id
+        for note, deck_id, model, fields in plan.adds:
+            requests.setdefault(deck_id, []).append(AddNoteRequest(_newAnkiNote(col, note, model, fields), deck_id))
+        for deck_requests in requests.values():
+            col.add_notes(deck_requests)
+        
+        print(F"Synced: {plan}")
+        
+        if plan.removals or plan.updates: # Images of removed or edited notes may be left behind
+            remOrphanMedia(col)
+        return plan
+
+def diffCardsFromNotes(notes: list[ProtoNote],
+                       deck_name: str = None,
+                       card_type: str = None,
+                       col_open: Collection | bool = False) -> "SyncPlan":
+    """
+    Dry run of syncCardsFromNotes(), prints and returns changes it would make without writing to the collection
+    Missing decks and note types are not created, notes which would go into them are counted as added
+    """
+    with openCollection(col_open) as col:
+        plan = planSync(col, notes, deck_name, card_type, create=False)
+        print(F"Diff: {plan}")
+        return plan
+
+def planSync(col: Collection, notes: list[ProtoNote], deck_name: str = None, card_type: str = None, create = True,
+             renamed: dict[str, str] | None = None) -> "SyncPlan":
+    """
+    Compares notes with existing auto notes using hashes of normalized fields and tags, see syncCardsFromNotes()
+    create: Create missing decks, otherwise nothing is written
+    renamed: Image names changed by registerMedia(), applied to planned fields
+    """
+    # Fetch all existing auto notes in a single query, tags are stored space-delimited with surrounding spaces
+    existing: dict[str, tuple[int, int, str, int]] = {} # GUID -> (note id, note type id, content hash, deck id)
+    plan = SyncPlan()
+    for nid, guid, mid, flds, tags, did in col.db.execute(
+            "select n.id, n.guid, n.mid, n.flds, n.tags, min(c.did) from notes n join cards c on c.nid = n.id "
+            "where n.tags like '% Auto %' group by n.id"):
+        if guid in existing: # Notes sharing a GUID with an earlier note, e.g., when added twice without replace
+            plan.removals.append(nid)
+        else:
+            existing[guid] = (nid, mid, _contentHash(flds.split("\x1f"), tags.split()), did)
+    
+    target_decks: set[int] = set()
+    resolved = _resolveNotes(col, notes, deck_name, card_type, create, _Progress(len(notes), "Prepared"), renamed)
+    for note, (deck_id, model, fields) in zip(notes, resolved):
+        target_decks.add(deck_id)
+        if note.guid not in existing or model == None: # New entry point, or note type doesn't exist yet
+            plan.adds.append((note, deck_id, model, fields))
+            continue
+        nid, mid, content_hash, did = existing.pop(note.guid)
+        if mid != model["id"]: # Changing note type is a schema change, re-add note instead
+            plan.removals.append(nid)
+            plan.adds.append((note, deck_id, model, fields))
+            continue
+        if did != deck_id:
+            plan.moves.setdefault(deck_id, []).append(nid)
+        if content_hash != _contentHash(fields, _noteTags(note)):
+            plan.updates.append((nid, note, fields))
+        elif did == deck_id:
+            plan.unchanged += 1
+    
+    target_decks.update(col.decks.id_for_name(name) for name in {deck_name} if name) # Explicit deck may be empty of new notes
+    for nid, mid, content_hash, did in existing.values(): # Remaining notes no longer exist in source
+        if did in target_decks:
+            plan.removals.append(nid)
+    return plan
+
+def addCardsViaAnkiConnect(notes: Iterable[ProtoNote],
+                           deck_name: str = None,
+                           card_type: str = None,
+                           replace = False,
+                           note_css: dict[str, str] | None = None,
+                           media: dict[str, bytes] | None = None,
+                           url: str = ANKICONNECT_URL,
+                           batch_size: int = ANKICONNECT_BATCH) -> list[int | None]:
+    """
+    Same as addCardsFromNotes() but through AnkiConnect, so Anki can stay open
+    Notes are sent in batches of batch_size per request as they come in, with the decks and images they need
+    GUIDs are not supported by AnkiConnect, notes added this way get random ones
+    Returns ids of added notes, None for notes which were rejected
+    """
+    with AnkiConnect(url) as client:
+        if note_css:
+            existing_models = set(client.invoke("modelNames"))
+            for model_name, css in note_css.items():
+                if model_name in existing_models:
+                    client.invoke("updateModelStyling", model={"name": model_name, "css": DEFAULT_CSS + css})
+                else:
+                    client.invoke("createModel", modelName=model_name, inOrderFields=FIELDS_CONTEXT, css=DEFAULT_CSS + css,
+                                  cardTemplates=[{"Name": "Card 1", "Front": QFMT_CONTEXT, "Back": AFMT_CONTEXT}])
+        
+        created_decks: set[str] = set() # Target decks which were created and, if replacing, cleared of auto cards
+        note_ids: list[int | None] = []
+        added_nids: set[int] = set() # Deck searches include subdecks, which may already have new notes
+        progress = _Progress(verb="Added")
+        for batch in _batched(notes, batch_size):
+            new_decks = {deck_name or n.deck for n in batch} - created_decks
+            if replace and new_decks: # Remove auto cards from target decks before the first note for them is added
+                deck_filter = " OR ".join(F'"deck:{targ_deck}"' for targ_deck in new_decks)
+                client.invoke("deleteNotes", notes=[nid for nid in client.invoke("findNotes", query=F"tag:Auto ({deck_filter})")
+                                                    if nid not in added_nids])
             
-                
+            batch_media = referencedMedia(batch, media) if media else {}
+            actions = [("storeMediaFile", {"filename": fname, "data": base64.b64encode(data).decode("ascii")})
+                       for fname, data in batch_media.items()]
+            actions += [("createDeck", {"deck": deck}) for deck in new_decks]
+            renamed: dict[str, str] = {}
+            if actions: # Single request for everything the batch needs
+                results = client.multi(actions)
+                renamed = {fname: stored for fname, stored in zip(batch_media, results) if stored != fname}
+            created_decks.update(new_decks)
+            
+            payload = []
+            for note in batch:
+                fields = {"Front": note.front, "Back": note.back}
+                if note.context: # Only set for note types with a Context field
+                    fields["Context"] = note.context
+                if renamed:
+                    fields = dict(zip(fields, renameMedia(list(fields.values()), renamed)))
+                payload.append({"deckName": deck_name or note.deck, "modelName": card_type or note.model, "fields": fields,
+                                "tags": _noteTags(note), "options": {"allowDuplicate": True}})
+            batch_ids = client.invoke("addNotes", notes=payload)
+            note_ids.extend(batch_ids)
+            if replace:
+                added_nids.update(nid for nid in batch_ids if nid)
+            progress.update(len(batch))
         
-        card_num = 1
-        for note in notes:
-            # Define deck and note type - can be used in the future to create different note types
-            if deck_name:
-                deck = col.decks.add_normal_deck_with_name(deck_name) # Returns a container with the deck id
-            else:
-                deck = col.decks.add_normal_deck_with_name(note.deck) 
-            if card_type:
-                model = col.models.by_name(card_type) # Returns a NoteType dict which is needed to specify new note
+        rejected = note_ids.count(None)
+        if rejected:
+            print(F"{rejected} cards were rejected by AnkiConnect")
+        return note_ids
+
+def readNoteStream(stream_path: str | os.PathLike, media: dict[str, bytes] | None = None) -> Iterator[ProtoNote]:
+    """
+    Yields notes of a stream written by NoteStreamWriter one line at a time
+    media: Filled with images of the stream as they are read, each image is added before the first note referencing it
+    """
+    with _openStream(stream_path, "r") as file:
+        header = json.loads(file.readline() or "{}")
+        if header.get("type") != "header" or header["version"] > NOTE_STREAM_VERSION:
+            raise ValueError(F"{stream_path} is not a note stream of version {NOTE_STREAM_VERSION} or older")
+        for line in file:
+            record = json.loads(line)
+            if record["type"] == "note":
+                yield ProtoNote(record["front"], record["back"], record["deck"], record["model"], record["tags"],
+                                record["context"], record["guid"])
+            elif record["type"] == "media" and media is not None:
+                media[record["name"]] = base64.b64decode(record["data"])
+
+def readStreamHeader(stream_path: str | os.PathLike) -> dict:
+    """
+    Returns header of a stream written by NoteStreamWriter, containing its version and note type styling
+    """
+    with _openStream(stream_path, "r") as file:
+        return json.loads(file.readline())
+
+def addCardsFromStreams(stream_paths: list[str | os.PathLike],
+                        deck_name: str = None,
+                        card_type: str = None,
+                        replace = False,
+                        report = False,
+                        col_open: Collection | bool = False):
+    """
+    Adds notes from streams written by NoteStreamWriter in order, in one session, see addCardsFromNotes()
+    Notes are read while earlier ones are being added, images are registered with the batch that first references them
+    and then released, so that memory doesn't grow with the number of streams
+    replace: Target decks are cleared once across all streams, so streams can share decks
+    """
+    note_css: dict[str, str] = {}
+    for stream_path in stream_paths: # Note types need to exist before adding
+        note_css.update(readStreamHeader(stream_path).get("note_css", {}))
+    media: dict[str, bytes] = {} # Filled while notes are read
+    notes = (note for stream_path in stream_paths for note in readNoteStream(stream_path, media))
+    addCardsFromNotes(notes, deck_name, card_type, replace, note_css, report, col_open, media, release_media=True)
+
+def noteGuid(object_id: str) -> str:
+    """
+    Derives a stable Anki note GUID from an entry point's OneNote objectID so that re-generated notes can be matched to existing ones
+    """
+    return base91(int.from_bytes(hashlib.sha1(object_id.encode("utf-8")).digest()[:8], "big")) # Same size and encoding as Anki's random GUIDs
+
+def _resolveNotes(col: Collection, notes: list[ProtoNote], deck_name: str = None, card_type: str = None,
+                  create = True, progress: _Progress | None = None,
+                  renamed: dict[str, str] | None = None) -> list[tuple[int | None, dict | None, list[str] | None]]:
+    """
+    Returns deck id, note type and field contents for each note 
+    Each deck and note type is resolved once, field indices are looked up per note type rather than per note
+    create: Create missing decks, otherwise their id is None. Fields are None if note type doesn't exist
+    renamed: Image names changed by registerMedia(), only applied to returned fields since notes may be shared with other sinks
+    """
+    deck_ids: dict[str, int] = {}
+    models: dict[str, tuple[dict, dict[str, int]]] = {}
+    resolved = []
+    for note in notes:
+        note_deck = deck_name or note.deck
+        if note_deck not in deck_ids:
+            if create:
+                deck_ids[note_deck] = col.decks.add_normal_deck_with_name(note_deck).id # Returns a container with the deck id
             else:
-                model = col.models.by_name(note.model) 
-
-            # Convert note into Anki format and add it
-            anki_note = col.new_note(model) # Create new note instance **Doesn't add note to collection
-            anki_note.fields[anki_note._field_index("Front")] = note.front # Note fields are stored in list of strings, need method to find index of labeled field
-            anki_note.fields[anki_note._field_index("Back")] = note.back
-            anki_note.add_tag("Auto") # Tag strings with spaces will be treated as separate tags 
-            for tag in note.tags: # Add each str in tags container as a tag
-                anki_note.add_tag(tag)
-            col.add_note(anki_note, deck.id) # Adds note to DB
-
-            print(f"Added card #{card_num}")
-            card_num += 1
-            
-        col.save() # Save DB, mostly redundant but added just in case 
-    finally: # Should have this always run, otherwise, anki will get stuck        
-        col.close() # Need this function, otherwise instance stays open
+                deck_ids[note_deck] = col.decks.id_for_name(note_deck)
+        note_model = card_type or note.model
+        if note_model not in models:
+            model = col.models.by_name(note_model) # Returns a NoteType dict which is needed to specify new note
+            models[note_model] = (model, {name: ind for ind, name in enumerate(col.models.field_names(model))} if model else None)
+        model, field_inds = models[note_model]
+        if model == None:
+            resolved.append((deck_ids[note_deck], None, None))
+            if progress:
+                progress.update()
+            continue
+        
+        fields = [""] * len(field_inds) # Note fields are stored in list of strings
+        fields[field_inds["Front"]] = note.front 
+        fields[field_inds["Back"]] = note.back
+        if note.context: # Only set for note types with a Context field
+            fields[field_inds["Context"]] = note.context
+        if renamed:
+            fields = renameMedia(fields, renamed)
+        resolved.append((deck_ids[note_deck], model, fields))
+        if progress:
+            progress.update()
+    return resolved
 
-def reportCollection(col_open: Collection | bool = False ):
-    try:
-        if not col_open: # Instantiate collection if not already open
-            col = Collection(CPATH)
-        else:
-            col = col_open
+def _batched(notes: Iterable[ProtoNote], size: int) -> Iterator[list[ProtoNote]]:
+    """
+    Groups notes into lists of up to size notes, only holding one batch at a time
+    """
+    batch: list[ProtoNote] = []
+    for note in notes:
+        batch.append(note)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def referencedMedia(notes: Iterable[ProtoNote], media_files: dict[str, bytes] | None = None,
+                    media_dir: str | os.PathLike | None = None) -> dict[str, bytes | str]:
+    """
+    Images referenced by image tags of notes in order of first reference, maps filename to its data or to its path in media_dir
+    Images which aren't found are left out, as are data URIs and links which need no media
+    media_files: Images kept in memory (e.g., renderer.BufferedMediaSink.files), take precedence over media_dir
+    media_dir: Directory images were written to by renderer.MediaDirSink, None to only look in media_files
+    """
+    found: dict[str, bytes | str] = {}
+    for note in notes:
+        for field in (note.front, note.back, note.context):
+            for src in IMG_SRC_RE.findall(field):
+                if src in found:
+                    continue
+                if media_files and src in media_files:
+                    found[src] = media_files[src]
+                elif media_dir and os.path.basename(src) == src and os.path.isfile(os.path.join(media_dir, src)):
+                    found[src] = os.path.join(media_dir, src)
+    return found
+
+def _openStream(stream_path: str | os.PathLike, mode: str):
+    if os.fspath(stream_path).endswith(".gz"):
+        return gzip.open(stream_path, mode + "t", encoding="utf-8")
+    return open(stream_path, mode, encoding="utf-8")
+
+def _contentHash(fields: list[str], tags: list[str]) -> bytes:
+    """
+    Hash of note content normalized the way Anki stores it (NFC), tags are case insensitive and unordered
+    Image references are compared case insensitively since the media manager may have lowercased filenames, see registerMedia()
+    """
+    content = IMG_SRC_RE.sub(lambda match: match.group(0).lower(), "\x1f".join(fields))
+    content += "\x1e" + " ".join(sorted({t.lower() for t in tags}))
+    return hashlib.sha1(unicodedata.normalize("NFC", content).encode("utf-8")).digest()
+
+def _noteTags(note: ProtoNote) -> list[str]:
+    return ["Auto"] + list(note.tags or []) # Tag strings with spaces will be treated as separate tags 
+
+def _newAnkiNote(col: Collection, note: ProtoNote, model: dict, fields: list[str], used_guids: set[str] | None = None) -> Note:
+    """
+    used_guids: GUIDs already in the collection, note keeps its random GUID if its own is taken. Updated with the GUID of the new note
+    """
+    anki_note = col.new_note(model) # Create new note instance **Doesn't add note to collection
+    anki_note.fields = fields
+    anki_note.tags = _noteTags(note)
+    if note.guid and (used_guids is None or note.guid not in used_guids): # Import, export and sync assume unique GUIDs
+        anki_note.guid = note.guid
+    if used_guids is not None:
+        used_guids.add(anki_note.guid)
+    return anki_note
+
+def ensureNoteType(col: Collection, name: str, css: str = ""):
+    """
+    Creates a note type laid out like "Basic" with css appended to the default styling
+    Has an extra Context field which is shown above both Front and Back so that shared context is only stored once per note
+    If it already exists, missing fields, templates and styling are updated
+    """
+    qfmt, afmt = QFMT_CONTEXT, AFMT_CONTEXT
+    new_css = col.models.new(name)["css"] + css # Default styling is not stored separately, regenerate it
+    
+    model = col.models.by_name(name)
+    if not model: 
+        model = col.models.new(name)
+        for field_name in FIELDS_CONTEXT:
+            col.models.add_field(model, col.models.new_field(field_name))
+        template = col.models.new_template("Card 1")
+        template["qfmt"] = qfmt
+        template["afmt"] = afmt
+        col.models.add_template(model, template)
+        model["css"] = new_css
+        col.models.add(model)
+        return model
+    
+    changed = False # Avoid writing note type if nothing changed since field changes require a full sync
+    for field_name in FIELDS_CONTEXT:
+        if field_name not in col.models.field_names(model):
+            col.models.add_field(model, col.models.new_field(field_name))
+            changed = True
+    template = model["tmpls"][0]
+    if (template["qfmt"], template["afmt"], model["css"]) != (qfmt, afmt, new_css):
+        template["qfmt"], template["afmt"], model["css"] = qfmt, afmt, new_css
+        changed = True
+    if changed:
+        col.models.update_dict(model)
+    return model
 
+def reportCollection(col_open: Collection | bool = False ):
+    with openCollection(col_open) as col:
+        # Single query instead of one per deck, cards in filtered decks also count towards their home deck (odid) like DeckManager.card_count()
+        deck_counts: dict[int, int] = dict(col.db.all(
+            "select did, count() from (select did from cards union all select odid from cards where odid != 0) group by did"))
         print(F"Notes: {col.note_count()} | Cards: {col.card_count()}")
         for deck_cont in col.decks.all_names_and_ids():
-            print(F"{deck_cont.name}: {col.decks.card_count(deck_cont.id, include_subdecks=False)}".encode("ascii", "replace"))
-        
-    finally:
-        if col_open:
-            return
-        col.close()
+            print(F"{deck_cont.name}: {deck_counts.get(deck_cont.id, 0)}".encode("ascii", "replace"))
     
 
      
-def remCards(filter: str = "tag:Auto", col_open: Collection | bool = False):
-    # Remove cards according to a filter
-    try:
-        if not col_open: # Instantiate collection if not already open
-            col = Collection(CPATH)
-        else:
-            col = col_open
-            
-        print(F"Before removal")
-        reportCollection(col)
+def remCards(filter: str = "tag:Auto", col_open: Collection | bool = False, report = True):
+    # Remove cards according to a filter, report prints card counts before and after removal
+    with openCollection(col_open) as col:
+        if report:
+            print(F"Before removal")
+            reportCollection(col)
         
         card_ids = col.find_cards(filter)
         col.remove_notes_by_card(card_ids)
+        print(F"Removed {len(card_ids)} cards")
         
-        print(F"After removal")
-        reportCollection(col)
+        if report:
+            print(F"After removal")
+            reportCollection(col)
+
+def registerMedia(files: dict[str, bytes], col_open: Collection | bool = False) -> dict[str, str]:
+    """
+    Adds images from a run (e.g., renderer.BufferedMediaSink.files) through Anki's media manager so that they are 
+    tracked in its media DB, rather than found by rescanning and rehashing the media folder in the next media check
+    Files already in the media folder with the same checksum are skipped, files with changed content are trashed and re-added
+    Returns filenames which the media manager stored under a different name (newer versions lowercase them), see renameMedia()
+    """
+    with openCollection(col_open) as col:
+        media_dir = col.media.dir()
+        added: list[str] = []
+        changed: list[str] = []
+        renamed: dict[str, str] = {}
+        for fname, data in files.items():
+            for stored_name in dict.fromkeys([fname, fname.lower()]): # Check both names the file may have been stored under
+                fpath = os.path.join(media_dir, stored_name)
+                if os.path.exists(fpath):
+                    break
+            else:
+                added.append(fname)
+                continue
+            if os.path.getsize(fpath) == len(data): # Only hash if size doesn't already differ
+                with open(fpath, "rb") as file:
+                    if hashlib.sha1(file.read()).digest() == hashlib.sha1(data).digest():
+                        if stored_name != fname:
+                            renamed[fname] = stored_name
+                        continue
+            changed.append(stored_name)
+            added.append(fname)
         
+        if changed: # Otherwise media manager would store new content under a different name than the old one
+            col.media.trash_files(changed)
+        for fname in added:
+            stored_name = col.media.write_data(fname, files[fname])
+            if stored_name != fname:
+                renamed[fname] = stored_name
+        print(F"Registered {len(added)} images, {len(files) - len(added)} unchanged")
+        return renamed
 
-    finally:
-        if col_open:
-            return
-        col.close()
+def renameMedia(fields: list[str], renamed: dict[str, str]) -> list[str]:
+    """
+    Returns fields with image references pointed to filenames returned by registerMedia()
+    Notes themselves are left untouched, they can be read by other sinks at the same time, see CardGenerator.runPipeline()
+    """
+    if not renamed:
+        return fields
+    replaceSrc = lambda match: match.group(0).replace(match.group(1), renamed.get(match.group(1), match.group(1)))
+    return [IMG_SRC_RE.sub(replaceSrc, field) for field in fields]
+
+def remOrphanMedia(col_open: Collection | bool = False, trash = True) -> list[str]:
+    """
+    Removes auto-generated images (matching IMG_NAME_RE) which are no longer referenced by any note
+    trash: Moves orphans into Anki's media trash (recoverable, registered for sync). Otherwise deletes files directly
+    Returns list of removed filenames
+    """
+    with openCollection(col_open) as col:
+        referenced: set[str] = set()
+        for fields in col.db.list("select flds from notes where flds like '%<img%'"): # Single query for all notes with images
+            referenced.update(IMG_SRC_RE.findall(fields))
+        
+        media_dir = col.media.dir()
+        orphans = [f for f in os.listdir(media_dir) 
+                   if IMG_NAME_RE.match(f) and f not in referenced] # Only consider files following generator naming scheme
+        
+        if orphans:
+            if trash:
+                col.media.trash_files(orphans) # Bulk removal through media manager
+            else:
+                for fname in orphans:
+                    os.remove(os.path.join(media_dir, fname))
+        print(F"Removed {len(orphans)} orphaned images")
+        return orphans
 
 #%%
 if __name__ == "__main__":
     if len(sys.argv) > 1: # If arguments passed in and running as main module
+        with openCollection() as col: # Commands share one session
             
-        if "report" in sys.argv:
-            reportCollection()
-        
-        if "remove" in sys.argv:
-            remCards("tag:Auto")
+            if "report" in sys.argv:
+                reportCollection(col)
+            
+            if "remove" in sys.argv:
+                remCards("tag:Auto", col)
+            
+            if "media" in sys.argv:
+                remOrphanMedia(col)
+            
+            if "import" in sys.argv: # Streams written by NoteStreamWriter, e.g., python anki_api.py import notes.jsonl
+                stream_paths = [arg for arg in sys.argv if arg.endswith((".jsonl", ".jsonl.gz"))]
+                addCardsFromStreams(stream_paths, replace="replace" in sys.argv, col_open=col)
@@ -0,0 +1,141 @@
+#%% Imports
+# Built-in
+import re, json, base64, threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+#%% Constants
+SEARCH_TERM_RE = re.compile(R'"(tag|deck):([^"]*)"|(tag|deck):([^\s()"]+)') # Quoted or bare tag: and deck: terms of a search
+
+#%% Classes
+
+class AnkiConnectStub:
+    """
+    Minimal local server implementing the AnkiConnect actions used by anki_api.addCardsViaAnkiConnect(), for tests and benchmarks
+    Decks, note types, notes and media are kept in memory. Supports keep-alive connections like AnkiConnect
+    with AnkiConnectStub() as stub:
+        addCardsViaAnkiConnect(notes, url=stub.url)
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.decks: set[str] = {"Default"}
+        self.models: dict[str, dict] = {"Basic": {"fields": ["Front", "Back"], "css": ""}}
+        self.notes: dict[int, dict] = {} # Note id -> note as sent by client
+        self.media: dict[str, bytes] = {}
+        self.requests = 0 # Number of HTTP requests handled
+        self.connections = 0 # Number of TCP connections accepted
+        self._next_id = 1
+        self._server = HTTPServer((host, port), _StubHandler) # Port 0 picks a free port
+        self._server.stub = self
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return F"http://{host}:{port}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def invoke(self, action: str, params: dict):
+        handler = getattr(self, "_" + action, None)
+        if handler is None:
+            raise ValueError(F"unsupported action {action}")
+        return handler(**params)
+
+    def _version(self):
+        return 6
+
+    def _multi(self, actions: list[dict]):
+        results = []
+        for action in actions:
+            try:
+                results.append({"result": self.invoke(action["action"], action.get("params", {})), "error": None})
+            except Exception as error:
+                results.append({"result": None, "error": str(error)})
+        return results
+
+    def _modelNames(self):
+        return list(self.models)
+
+    def _createModel(self, modelName: str, inOrderFields: list[str], cardTemplates: list[dict], css: str = ""):
+        if modelName in self.models:
+            raise ValueError("Model name already exists")
+        self.models[modelName] = {"fields": inOrderFields, "css": css, "templates": cardTemplates}
+
+    def _updateModelStyling(self, model: dict):
+        self.models[model["name"]]["css"] = model["css"]
+
+    def _deckNames(self):
+        return sorted(self.decks)
+
+    def _createDeck(self, deck: str):
+        parts = deck.split("::")
+        self.decks.update("::".join(parts[:depth]) for depth in range(1, len(parts) + 1))
+
+    def _storeMediaFile(self, filename: str, data: str):
+        self.media[filename] = base64.b64decode(data)
+        return filename
+
+    def _addNotes(self, notes: list[dict]):
+        note_ids = []
+        for note in notes:
+            model = self.models.get(note["modelName"])
+            if note["deckName"] not in self.decks or model is None or set(note["fields"]) - set(model["fields"]):
+                note_ids.append(None) # AnkiConnect reports notes it can't add as null
+                continue
+            self.notes[self._next_id] = note
+            note_ids.append(self._next_id)
+            self._next_id += 1
+        return note_ids
+
+    def _findNotes(self, query: str):
+        """
+        Only supports searches like 'tag:Auto ("deck:A" OR "deck:B")', all tags and any of the decks must match
+        """
+        terms = [(match[0] or match[2], (match[1] or match[3]).lower()) for match in SEARCH_TERM_RE.findall(query)]
+        tags = [value for kind, value in terms if kind == "tag"]
+        decks = [value for kind, value in terms if kind == "deck"]
+        return [nid for nid, note in self.notes.items()
+                if all(tag in {t.lower() for t in note["tags"]} for tag in tags)
+                and (not decks or any(note["deckName"].lower() == deck or note["deckName"].lower().startswith(deck + "::") for deck in decks))]
+
+    def _deleteNotes(self, notes: list[int]):
+        for nid in notes:
+            self.notes.pop(nid, None)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keeps connections open between requests
+
+    def setup(self):
+        super().setup()
+        self.server.stub.connections += 1
+
+    def do_POST(self):
+        stub: AnkiConnectStub = self.server.stub
+        stub.requests += 1
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        try:
+            response = {"result": stub.invoke(request["action"], request.get("params", {})), "error": None}
+        except Exception as error:
+            response = {"result": None, "error": str(error)}
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # Don't print every request
+        pass
@@ -0,0 +1,164 @@
+#%% Imports
+# Built-in
+import os, re, json, time, html, hashlib, sqlite3, zipfile, tempfile
+from typing import Union
+from collections.abc import Iterable
+
+# Internal modules
+from internal_globals import MPATH, DEFAULT_CSS
+from anki_api import ProtoNote, noteGuid, referencedMedia, COMPACT_MODEL, CONTEXT_MODEL, FIELDS_CONTEXT, QFMT_CONTEXT, AFMT_CONTEXT
+
+#%% Constants
+IMG_TAG_RE = re.compile(R"<img[^>]*?src=[\"']([^\"']+)[\"'][^>]*>") # Whole image tag, captures filename
+SCHEMA_VERSION = 11 # Legacy collection schema, still accepted by current Anki importers
+TEMPLATES = { # Note type name -> (fields, question template, answer template), same layout as note types in anki_api
+    "Basic": (["Front", "Back"], "{{Front}}", "{{FrontSide}}\n\n<hr id=answer>\n\n{{Back}}"),
+    COMPACT_MODEL: (FIELDS_CONTEXT, QFMT_CONTEXT, AFMT_CONTEXT),
+    CONTEXT_MODEL: (FIELDS_CONTEXT, QFMT_CONTEXT, AFMT_CONTEXT),
+}
+DECK_CONF = { # Anki's default options group, only used if importing profile has no options group with the same ID
+    "id": 1, "mod": 0, "name": "Default", "usn": 0, "maxTaken": 60, "autoplay": True, "timer": 0, "replayq": True, "dyn": False,
+    "new": {"bury": False, "delays": [1.0, 10.0], "initialFactor": 2500, "ints": [1, 4, 0], "order": 1, "perDay": 20},
+    "rev": {"bury": False, "ease4": 1.3, "ivlFct": 1.0, "maxIvl": 36500, "perDay": 200, "hardFactor": 1.2},
+    "lapse": {"delays": [10.0], "leechAction": 1, "leechFails": 8, "minInt": 1, "mult": 0.0},
+}
+SCHEMA = """
+CREATE TABLE col (id integer primary key, crt integer not null, mod integer not null, scm integer not null, ver integer not null,
+    dty integer not null, usn integer not null, ls integer not null, conf text not null, models text not null, decks text not null,
+    dconf text not null, tags text not null);
+CREATE TABLE notes (id integer primary key, guid text not null, mid integer not null, mod integer not null, usn integer not null,
+    tags text not null, flds text not null, sfld integer not null, csum integer not null, flags integer not null, data text not null);
+CREATE TABLE cards (id integer primary key, nid integer not null, did integer not null, ord integer not null, mod integer not null,
+    usn integer not null, type integer not null, queue integer not null, due integer not null, ivl integer not null,
+    factor integer not null, reps integer not null, lapses integer not null, left integer not null, odue integer not null,
+    odid integer not null, flags integer not null, data text not null);
+CREATE TABLE revlog (id integer primary key, cid integer not null, usn integer not null, ease integer not null, ivl integer not null,
+    lastIvl integer not null, factor integer not null, time integer not null, type integer not null);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn ON notes (usn);
+CREATE INDEX ix_cards_usn ON cards (usn);
+CREATE INDEX ix_revlog_usn ON revlog (usn);
+CREATE INDEX ix_cards_nid ON cards (nid);
+CREATE INDEX ix_cards_sched ON cards (did, queue, due);
+CREATE INDEX ix_revlog_cid ON revlog (cid);
+CREATE INDEX ix_notes_csum ON notes (csum);
+"""
+
+#%% Functions
+
+def writeApkg(apkg_path: Union[str, os.PathLike],
+              notes: Iterable[ProtoNote],
+              media_dir: Union[str, os.PathLike, None] = None,
+              note_css: dict[str, str] | None = None,
+              media_files: dict[str, bytes] | None = None) -> str:
+    """
+    Writes notes into an Anki package which can be imported into any profile, without opening a collection
+    Notes are inserted with a few bulk statements into a legacy schema collection, which is zipped with referenced images
+    media_dir, media_files: Where referenced images are looked up, see anki_api.referencedMedia(). media_dir defaults to MPATH
+    note_css: Styling appended to default styling of each note type, maps note type name to its CSS
+    Returns apkg_path
+    """
+    notes = list(notes)
+    media = referencedMedia(notes, media_files, media_dir or MPATH) # Referenced files which were found, in order of first appearance
+    now = int(time.time())
+    base_id = now * 1000 # Note and card IDs are millisecond timestamps, offset per note to keep them unique
+
+    models = {name: _genModel(name, (note_css or {}).get(name, ""), now) for name in {n.model for n in notes}}
+    decks: dict[str, dict] = {"Default": _genDeck("Default", 1, now)} # Default deck always needs to exist
+    for note in notes:
+        parts = note.deck.split("::")
+        for depth in range(1, len(parts) + 1): # Parents are included so that importer doesn't need to infer them
+            name = "::".join(parts[:depth])
+            if name not in decks:
+                decks[name] = _genDeck(name, _stableId(name), now)
+
+    note_rows = []
+    card_rows = []
+    for ind, note in enumerate(notes):
+        model = models[note.model]
+        field_names = [f["name"] for f in model["flds"]]
+        fields = [""] * len(field_names)
+        fields[field_names.index("Front")] = note.front
+        fields[field_names.index("Back")] = note.back
+        if note.context:
+            fields[field_names.index("Context")] = note.context
+        sort_field = _stripHtml(fields[0])
+        tags = " " + " ".join(["Auto"] + list(note.tags or [])) + " " # Stored space-delimited with surrounding spaces
+        checksum = int(hashlib.sha1(sort_field.encode("utf-8")).hexdigest()[:8], 16) # Used by Anki for duplicate checks
+        guid = note.guid or noteGuid(f"{note.deck}\x1f{fields[0]}") # Package notes need a GUID for import to match them later
+        note_rows.append((base_id + ind, guid, model["id"], now, -1, tags, "\x1f".join(fields), sort_field, checksum, 0, ""))
+        card_rows.append((base_id + ind, base_id + ind, decks[note.deck]["id"], 0, now, -1, 0, 0, ind + 1, 0, 0, 0, 0, 0, 0, 0, 0, "")) # New card, due is position in new queue
+
+    conf = {"nextPos": len(notes) + 1, "curDeck": 1, "activeDecks": [1], "schedVer": 2}
+    dconf = {"1": DECK_CONF}
+
+    fd, db_path = tempfile.mkstemp(suffix=".anki2", dir=os.path.dirname(os.path.abspath(apkg_path)))
+    os.close(fd)
+    try:
+        db = sqlite3.connect(db_path)
+        with db: # Single transaction for all inserts
+            db.executescript(SCHEMA)
+            db.execute("insert into col values (1, ?, ?, ?, ?, 0, 0, 0, ?, ?, ?, ?, '{}')",
+                       (now, base_id, base_id, SCHEMA_VERSION, json.dumps(conf),
+                        json.dumps({str(m["id"]): m for m in models.values()}),
+                        json.dumps({str(d["id"]): d for d in decks.values()}),
+                        json.dumps(dconf)))
+            db.executemany("insert into notes values (?,?,?,?,?,?,?,?,?,?,?)", note_rows)
+            db.executemany("insert into cards values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", card_rows)
+        db.close()
+
+        with zipfile.ZipFile(apkg_path, "w", zipfile.ZIP_DEFLATED) as apkg:
+            apkg.write(db_path, "collection.anki2")
+            apkg.writestr("media", json.dumps({str(ind): name for ind, name in enumerate(media)})) # Media manifest, files are stored by index
+            for ind, data in enumerate(media.values()): # PNGs are already compressed
+                if isinstance(data, bytes):
+                    apkg.writestr(str(ind), data, zipfile.ZIP_STORED)
+                else: # Path in media_dir
+                    apkg.write(data, str(ind), zipfile.ZIP_STORED)
+    finally:
+        os.remove(db_path)
+    print(F"Wrote {len(note_rows)} cards and {len(media)} images to {apkg_path}")
+    return apkg_path
+
+def writeApkgPerDeck(out_dir: Union[str, os.PathLike],
+                     notes: Iterable[ProtoNote],
+                     media_dir: Union[str, os.PathLike, None] = None,
+                     note_css: dict[str, str] | None = None,
+                     media_files: dict[str, bytes] | None = None) -> list[str]:
+    """
+    Writes one package per deck into out_dir, named after the deck, see writeApkg()
+    Returns paths of written packages
+    """
+    decks: dict[str, list[ProtoNote]] = {}
+    for note in notes:
+        decks.setdefault(note.deck, []).append(note)
+    return [writeApkg(os.path.join(out_dir, re.sub(R'[\\/:*?"<>|]+', "_", deck) + ".apkg"), deck_notes, media_dir, note_css, media_files)
+            for deck, deck_notes in decks.items()]
+
+def _genModel(name: str, css: str, now: int) -> dict:
+    """
+    Legacy note type dict, only note types in TEMPLATES are known
+    ID is derived from name so that repeated imports reuse the note type created by the first import
+    """
+    field_names, qfmt, afmt = TEMPLATES[name]
+    return {
+        "id": _stableId(name), "name": name, "type": 0, "mod": now, "usn": -1, "sortf": 0, "did": None,
+        "tmpls": [{"name": "Card 1", "ord": 0, "qfmt": qfmt, "afmt": afmt, "bqfmt": "", "bafmt": "", "did": None, "bfont": "", "bsize": 0}],
+        "flds": [{"name": field_name, "ord": ind, "sticky": False, "rtl": False, "font": "Arial", "size": 20, "media": []}
+                 for ind, field_name in enumerate(field_names)],
+        "css": DEFAULT_CSS + css, "latexPre": "", "latexPost": "", "req": [[0, "any", [0]]], "tags": [], "vers": [],
+    }
+
+def _genDeck(name: str, deck_id: int, now: int) -> dict:
+    return {"id": deck_id, "name": name, "mod": now, "usn": -1, "desc": "", "dyn": 0, "conf": 1, "collapsed": False,
+            "newToday": [0, 0], "revToday": [0, 0], "lrnToday": [0, 0], "timeToday": [0, 0], "extendNew": 0, "extendRev": 0}
+
+def _stableId(name: str) -> int:
+    return int(hashlib.sha1(name.encode("utf-8")).hexdigest()[:11], 16) # 44 bits, stays within range of JSON numbers
+
+def _stripHtml(text: str) -> str:
+    """
+    Approximates Anki's sort field, images are replaced by their filename
+    """
+    text = IMG_TAG_RE.sub(lambda match: " " + match.group(1) + " ", text)
+    return html.unescape(re.sub(R"<[^>]*>", "", text))
@@ -1,7 +1,8 @@
 # Built-in
-import os
+import os, glob, queue, threading
+from concurrent.futures import ProcessPoolExecutor
 from typing import Union
-from collections.abc import Iterable
+from collections.abc import Iterable, Iterator, Callable
 from xml.etree import ElementTree
 from xml.etree.ElementTree import Element
 
@@ -12,24 +13,54 @@ from xml.etree.ElementTree import Element
 # Internal modules
 # from . import internal_globals, renderer_std
 from internal_globals import FLAG_EMPTY, FLAG_PIORITY1, FLAG_IGNORE, FLAG_RECIGNORE
-from renderer import StandardRenderer
+from renderer import StandardRenderer, RenderCache, MediaDirSink, InlineMediaSink, BufferedMediaSink, COMPACT_CSS, SIBLING_WINDOW, ANCESTOR_DEPTH
 from onenote import OENodeHeader, OENodePoint, getHeaders, getParentNames
-from anki_api import ProtoNote, addCardsFromNotes
+from anki_api import ProtoNote, NoteStreamWriter, addCardsFromNotes, addCardsViaAnkiConnect, syncCardsFromNotes, diffCardsFromNotes, noteGuid, COMPACT_MODEL, CONTEXT_MODEL, Collection, SyncPlan
+from apkg import writeApkg, writeApkgPerDeck
+
+#%% Constants
+PIPELINE_QUEUE_SIZE = 256 # Notes buffered per sink in runPipeline(), rendering waits once a sink falls this far behind
+_DONE = object() # Marks end of notes in pipeline queues
+BATCH_WORKERS = None # Processes used by genStreams(), None for one per CPU
 
 #%% Classes
 
 class CardGenerator:
     
-    def __init__(self, xml_path: Union[str, bytes, os.PathLike], outline_path: Union[str, bytes, os.PathLike]):
-        self.outline: ElementTree.ElementTree = ElementTree.parse(outline_path)
+    def __init__(self, xml_path: Union[str, bytes, os.PathLike], outline_path: Union[str, bytes, os.PathLike, ElementTree.ElementTree],
+                 media: Union[MediaDirSink, InlineMediaSink, BufferedMediaSink, None] = None,
+                 compact: bool = False,
+                 sibling_window: int | None = SIBLING_WINDOW,
+                 ancestor_depth: int | None = ANCESTOR_DEPTH,
+                 context_field: bool | None = None):
+        """
+        outline_path: Can also be an already parsed outline, e.g., shared by all pages of a batch, see genStreams()
+        media: Sink for rendered images, defaults to writing into the Anki media folder. Use InlineMediaSink for previews
+        BufferedMediaSink images are registered with Anki's media manager when adding or syncing cards, or packed into .apkg files
+        compact: Style cards with CSS classes on a dedicated note type (COMPACT_MODEL) instead of inline styles on "Basic"
+        context_field: Store page and header context once in the note's Context field instead of on both front and back,
+        None to follow compact. Inline styled cards then use CONTEXT_MODEL instead of "Basic"
+        sibling_window, ancestor_depth: Bound context rendered around each entry point, see StandardRenderer
+        """
+        if isinstance(outline_path, ElementTree.ElementTree): # Only read from, never modified
+            self.outline: ElementTree.ElementTree = outline_path
+        else:
+            self.outline: ElementTree.ElementTree = ElementTree.parse(outline_path)
         self.page: ElementTree.ElementTree = ElementTree.parse(xml_path)
         self.header_list: list[OENodeHeader] = getHeaders(self.page, self.outline) # Input header list, should be able to access rest of nodes through this point
         self.parent_names: list[str] = getParentNames(self.page, self.outline) # Serves as base to add onto at page level
         self.notes: list[ProtoNote] = [] # Container for generated cards, format of Tuple[front, back]
+        self.media = media or MediaDirSink()
+        self.compact = compact
+        self.sibling_window = sibling_window
+        self.ancestor_depth = ancestor_depth
+        self.context_field = compact if context_field == None else context_field
 
-    def genNotes(self):
+    def iterNotes(self) -> Iterator[ProtoNote]:
         """
-        Note that this will still copy media into anki media directory if there are images
+        Yields notes as each entry point is rendered, without keeping them in self.notes
+        Fragments cached for one header are released once the next header starts, memory is bounded by the largest header rather than the page
+        Note that this will still copy media into anki media directory if there are images, unless a different media sink was given
         """
         first_header = self.header_list[0] # Get first header as prototypical header
 
@@ -39,12 +70,13 @@ class CardGenerator:
         all_parents: list[str] = self.parent_names + parent_page_titles
         deck_path = "::".join(all_parents)
         
-        def enterEntryPoints(cur_node: OENodeHeader | OENodePoint):
+        def enterEntryPoints(cur_node: OENodeHeader | OENodePoint, cache: RenderCache):
             for child_node in cur_node.children_nodes: # Starting point for nodes directly under header (or Element if in nested loop)
                 if child_node.type in ["concept", "grouping",]: # Only certain types of nodes will trigger card generation
 
                     # Fill front and back 
-                    renderer = StandardRenderer(child_node) # New instance for each entry point
+                    renderer = StandardRenderer(child_node, self.media, cache, self.compact,
+                                                self.sibling_window, self.ancestor_depth, self.context_field) # New instance for each entry point
                     renderer.renderHtml()
                     
                     ignore_flags = list({FLAG_IGNORE, FLAG_RECIGNORE} & child_node.flags)
@@ -53,40 +85,243 @@ class CardGenerator:
                         note = ProtoNote(front=renderer.fronthtml,
                                         back=renderer.backhtml,
                                         deck=deck_path,
-                                        model="Basic",
-                                        tags=child_node.flags,) # Convert flags to tags
+                                        model=self._noteModel(),
+                                        tags=child_node.flags, # Convert flags to tags
+                                        context=renderer.contexthtml,
+                                        guid=noteGuid(child_node.id) if child_node.id else None,) # Lets later runs update this note in place
                                        
-                        self.notes.append(note) # Append rendered HTMLs
+                        yield note # Hand over rendered HTMLs
 
                     if child_node.children_nodes: # Recursively search for children, may be empty but still have children 
                         # Only becomes relevant after OENodeHeader loop
-                        enterEntryPoints(child_node) 
-            return None
+                        yield from enterEntryPoints(child_node, cache) 
         
-        for header in self.header_list:
-            enterEntryPoints(header)
-            
-        return self
+        for header in self.header_list: # Context of an entry point never extends past its header
+            yield from enterEntryPoints(header, RenderCache()) # Fragments rendered for one entry point are reused by its siblings
         
-    def displayCards(self, html_path):
+    def genNotes(self):
+        """
+        Renders all notes into self.notes, see iterNotes() for streaming them instead
+        """
+        self.notes.extend(self.iterNotes())
+        return self
+    
+    def runPipeline(self, sinks: list[Callable[[Iterable[ProtoNote]], object]], queue_size: int = PIPELINE_QUEUE_SIZE):
+        """
+        Renders notes once and streams them into each sink while rendering continues, instead of rendering all notes first
+        Each sink is called in its own thread with an iterable of notes, e.g., lambda notes: self.displayCards(path, notes=notes)
+        Rendering waits while any sink is queue_size notes behind, so memory stays bounded by the slowest sink
+        Errors raised by sinks are re-raised once all notes are rendered and the other sinks have finished
+        """
+        queues = [queue.Queue(maxsize=queue_size) for _ in sinks]
+        errors: list[BaseException] = []
+        threads = [threading.Thread(target=_consume, args=(sink, note_queue, errors), daemon=True)
+                   for sink, note_queue in zip(sinks, queues)]
+        for thread in threads:
+            thread.start()
+        try:
+            for note in self.iterNotes():
+                for note_queue in queues:
+                    note_queue.put(note)
+        finally: # Sinks finish with the notes they have so far if rendering fails
+            for note_queue in queues:
+                note_queue.put(_DONE)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+        return self
+    
+    def displayCards(self, html_path, page_size: int | None = None, notes: Iterable[ProtoNote] | None = None):
         """
         Display generated card in HTML format, for debuggging purposes
+        page_size: Number of cards per preview page, html_path becomes an index of pages if specified
+        notes: Defaults to generated notes, e.g., streamed by runPipeline()
         """
-        html = ""
-        card_num = 1
-        for note in self.notes:
-            html += f"<br>Card no. {card_num}:<br>\n" + note.front + "<hr>\n" + note.back + "<hr><hr><br>\n" # Add front and back with spacing between both and next set of cards
-            card_num += 1
-        with open(html_path, "w", encoding="utf-8") as file:
-            file.write(html)
+        css = COMPACT_CSS if self.compact else "" # Compact cards rely on note type styling
+        with PreviewWriter(html_path, page_size, css) as writer:
+            for note in (self.notes if notes is None else notes):
+                writer.write(note)
         return self
         
-    def addCards(self, replace = False):
+    def addCards(self, replace = False, col_open: Collection | bool = False, connect_url: str | None = None,
+                 notes: Iterable[ProtoNote] | None = None):
         # Replace argument to replace Automatically-generated cards in the respective decks
-        addCardsFromNotes(self.notes, replace=replace)
+        # col_open: Session from anki_api.openCollection() to reuse, otherwise collection is opened for this call only
+        # connect_url: Add cards through AnkiConnect at this address instead of opening the collection, Anki can then stay open
+        # notes: Defaults to generated notes, added in batches as they come in when streamed by runPipeline()
+        notes = self.notes if notes is None else notes
+        if connect_url:
+            addCardsViaAnkiConnect(notes, replace=replace, note_css=self._noteCss(), media=self._mediaFiles(), url=connect_url)
+            return
+        addCardsFromNotes(notes, replace=replace, note_css=self._noteCss(), col_open=col_open, media=self._mediaFiles())
+    
+    def writeJsonl(self, jsonl_path, notes: Iterable[ProtoNote] | None = None):
+        """
+        Writes notes and the images they reference into a stream for importing separately, see anki_api.NoteStreamWriter
+        Lets generation run in several processes or on other machines while anki_api.addCardsFromStreams() is the only writer
+        """
+        with NoteStreamWriter(jsonl_path, self._mediaFiles(), self._mediaDir(), self._noteCss()) as writer:
+            for note in (self.notes if notes is None else notes):
+                writer.write(note)
+        print(F"Wrote {writer.note_count} cards to {jsonl_path}")
+        return self
+    
+    def syncCards(self, col_open: Collection | bool = False):
+        """
+        Updates existing auto cards in place instead of replacing them, keeping review history of unchanged entry points
+        """
+        return syncCardsFromNotes(self.notes, note_css=self._noteCss(), col_open=col_open, media=self._mediaFiles())
+    
+    def diffCards(self, col_open: Collection | bool = False) -> SyncPlan:
+        """
+        Summarizes what syncCards() would change without writing anything
+        """
+        return diffCardsFromNotes(self.notes, col_open=col_open)
+    
+    def writePackage(self, apkg_path, per_deck = False):
+        """
+        Writes notes into an .apkg file for importing instead of adding them to the collection, see apkg.writeApkg()
+        per_deck: apkg_path is a directory which gets one package per deck
+        """
+        if per_deck:
+            return writeApkgPerDeck(apkg_path, self.notes, self._mediaDir(), self._noteCss(), self._mediaFiles())
+        return writeApkg(apkg_path, self.notes, self._mediaDir(), self._noteCss(), self._mediaFiles())
+    
+    def _noteModel(self) -> str:
+        if self.compact:
+            return COMPACT_MODEL
+        return CONTEXT_MODEL if self.context_field else "Basic"
+    
+    def _noteCss(self) -> dict[str, str] | None:
+        if self.compact: # Install or update styling for compact cards
+            return {COMPACT_MODEL: COMPACT_CSS}
+        return {CONTEXT_MODEL: ""} if self.context_field else None # Only needs to exist, styling is inline
+    
+    def _mediaDir(self) -> str | None:
+        return getattr(self.media, "media_dir", None) # Images are only written to disk by MediaDirSink
+    
+    def _mediaFiles(self) -> dict[str, bytes] | None:
+        return self.media.files if isinstance(self.media, BufferedMediaSink) else None # Other sinks have already stored their images
+        
+
         
 
+class PreviewWriter:
+    """
+    Streams notes into HTML preview files as they are produced instead of building the whole preview in memory
+    If page_size is given, cards are split into pages of page_size cards and html_path is written as an index linking to each page
+    css: Styling added to each page, for cards which rely on note type styling
+    """
+    def __init__(self, html_path: Union[str, os.PathLike], page_size: int | None = None, css: str = ""):
+        self.html_path = html_path
+        self.page_size = page_size
+        self.css = css
+        self.card_num = 0 # Number of cards written so far
+        self.page_paths: list[str] = [] # Only populated when paginating
+        self._file = None # Currently open page
         
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def write(self, note: ProtoNote):
+        if self._file is None or (self.page_size and self.card_num % self.page_size == 0): # Start a new page when current one is full
+            self._openPage()
+        self.card_num += 1
+        # Add front and back with spacing between both and next set of cards, images only load once scrolled into view
+        self._file.write(f"<br>Card no. {self.card_num}:<br>\n" + note.context + _lazyImages(note.front) + "<hr>\n" + note.context + _lazyImages(note.back) + "<hr><hr><br>\n")
+        
+    def close(self):
+        if self._file is None: # Nothing written, still produce an (empty) preview
+            self._openPage()
+        self._file.close()
+        if self.page_size: # Index is written last since number of pages is only known at the end
+            with open(self.html_path, "w", encoding="utf-8") as file:
+                for page_num, page_path in enumerate(self.page_paths):
+                    first_card = page_num*self.page_size + 1
+                    last_card = min((page_num + 1)*self.page_size, self.card_num)
+                    file.write(f"<a href='{os.path.basename(page_path)}'>Cards {first_card}-{last_card}</a><br>\n")
+    
+    def _openPage(self):
+        if self._file is not None:
+            self._file.close()
+        if self.page_size:
+            root, ext = os.path.splitext(self.html_path)
+            page_path = f"{root}_{len(self.page_paths) + 1:03d}{ext}" # E.g., displayCards_output_001.html
+            self.page_paths.append(page_path)
+            self._file = open(page_path, "w", encoding="utf-8")
+            self._file.write(f"<a href='{os.path.basename(self.html_path)}'>Index</a><br>\n")
+        else:
+            self._file = open(self.html_path, "w", encoding="utf-8")
+        if self.css:
+            self._file.write(f"<style>{self.css}</style>\n")
+
+def findPages(source: Union[str, os.PathLike]) -> list[str]:
+    """
+    Returns page exports in a directory (*.xml) or matching a glob pattern, sorted so that batches are processed in a fixed order
+    """
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, "*.xml")))
+    return sorted(glob.glob(os.fspath(source)))
+
+def genStreams(page_paths: list[Union[str, os.PathLike]], outline_path: Union[str, os.PathLike],
+               stream_dir: Union[str, os.PathLike], compact: bool = False, context_field: bool | None = None,
+               workers: int | None = BATCH_WORKERS) -> list[str]:
+    """
+    Renders many page exports in a process pool, each page into its own note stream in stream_dir (see CardGenerator.writeJsonl())
+    The outline is parsed once and handed to each worker process instead of being parsed again for every page
+    Returns stream paths in order of page_paths, import with anki_api.addCardsFromStreams() to merge notes in that order
+    Pages which fail to render are reported and skipped so that one bad export doesn't stop the whole batch
+    """
+    outline = ElementTree.parse(outline_path)
+    os.makedirs(stream_dir, exist_ok=True)
+    stream_paths = [os.path.join(stream_dir, f"{ind:05d}_{os.path.splitext(os.path.basename(page_path))[0]}.jsonl") # Unique even if pages share names
+                    for ind, page_path in enumerate(page_paths)]
+    written: list[str] = []
+    with ProcessPoolExecutor(workers, initializer=_initWorker, initargs=(outline,)) as executor:
+        futures = [executor.submit(_genStream, page_path, stream_path, compact, context_field) for page_path, stream_path in zip(page_paths, stream_paths)]
+        for page_path, stream_path, future in zip(page_paths, stream_paths, futures): # Collected in submission order, not completion order
+            try:
+                future.result()
+                written.append(stream_path)
+            except Exception as error:
+                print(F"Skipped {page_path}: {error!r}")
+    print(F"Generated {len(written)}/{len(page_paths)} pages into {stream_dir}")
+    return written
+
+_worker_outline: ElementTree.ElementTree | None = None # Outline shared by all pages rendered in a genStreams() worker process
+
+def _initWorker(outline: ElementTree.ElementTree):
+    global _worker_outline
+    _worker_outline = outline
+
+def _genStream(page_path: Union[str, os.PathLike], stream_path: str, compact: bool, context_field: bool | None) -> str:
+    crawler = CardGenerator(page_path, _worker_outline, media=BufferedMediaSink(), compact=compact, context_field=context_field)
+    crawler.writeJsonl(stream_path, crawler.iterNotes()) # Notes of a page aren't kept in memory
+    return stream_path
+
+def _consume(sink: Callable[[Iterable[ProtoNote]], object], note_queue: queue.Queue, errors: list[BaseException]):
+    """
+    Runs sink on notes from note_queue, see CardGenerator.runPipeline()
+    """
+    notes = _iterQueue(note_queue)
+    try:
+        sink(notes)
+    except BaseException as error:
+        errors.append(error)
+    finally: # Keeps taking notes if sink stopped early, otherwise rendering would wait on the full queue
+        for _ in notes:
+            pass
+
+def _iterQueue(note_queue: queue.Queue) -> Iterator[ProtoNote]:
+    while (note := note_queue.get()) is not _DONE:
+        yield note
+
+def _lazyImages(html: str) -> str:
+    return html.replace("<img ", "<img loading='lazy' ") # Defer loading of images until they are close to the viewport
 
 
 #%%
@@ -0,0 +1,459 @@
+#%% Imports
+# Built-in
+import os, re, json, time, random, shutil, sqlite3, hashlib, tempfile, functools
+from typing import Union, NamedTuple
+from collections.abc import Iterable
+
+# Internal modules
+from internal_globals import DEFAULT_CSS
+
+#%% Constants
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS col (id integer primary key, models text not null, decks text not null);
+CREATE TABLE IF NOT EXISTS notes (id integer primary key, guid text not null, mid integer not null, tags text not null, flds text not null);
+CREATE TABLE IF NOT EXISTS cards (id integer primary key, nid integer not null, did integer not null, ord integer not null, odid integer not null default 0);
+CREATE INDEX IF NOT EXISTS ix_cards_nid ON cards (nid);
+""" # Subset of Anki's schema, column names match so that raw queries in anki_api run unchanged
+SEARCH_TOKEN_RE = re.compile(R'\(|\)|-?"[^"]*"|[^\s()]+') # Parentheses, quoted terms and bare terms
+BASE91_CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!#$%&()*+,-./:;<=>?@[]^_`{|}~" # Same alphabet as anki.utils.base91
+
+#%% Classes
+
+class CallStats:
+    """
+    Call counts and cumulative time per method of a FakeCollection and its managers
+    """
+    def __init__(self) -> None:
+        self.counts: dict[str, int] = {}
+        self.times: dict[str, float] = {}
+
+    def record(self, name: str, seconds: float):
+        self.counts[name] = self.counts.get(name, 0) + 1
+        self.times[name] = self.times.get(name, 0.0) + seconds
+
+    def reset(self):
+        self.counts.clear()
+        self.times.clear()
+
+    def __str__(self) -> str:
+        lines = [F"{'Call':<40}{'Count':>8}{'Total ms':>12}"]
+        for name in sorted(self.times, key=self.times.get, reverse=True): # Slowest first
+            lines.append(F"{name:<40}{self.counts[name]:>8}{self.times[name] * 1000:>12.2f}")
+        return "\n".join(lines)
+
+def _recorded(method):
+    """
+    Records calls to method in the stats of the instance it is bound to
+    """
+    name = method.__qualname__
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.stats.record(name, time.perf_counter() - start)
+    return wrapper
+
+
+class DeckNameId(NamedTuple):
+    name: str
+    id: int
+
+class AddNoteRequest(NamedTuple):
+    note: "Note"
+    deck_id: int
+
+
+class FakeCollection:
+    """
+    Local stand-in for anki.storage.Collection, implements the subset of its API used by anki_api
+    Notes and cards are kept in SQLite with the same table and column names as Anki, so raw queries through db run unchanged
+    Every call is counted and timed in stats, so that import paths can be benchmarked without Anki, e.g., in CI
+    path: Collection file, or ":memory:" for a collection discarded on close. Media is kept next to it like Anki does
+    """
+    def __init__(self, path: Union[str, os.PathLike] = ":memory:"):
+        self.path = path
+        self.stats = CallStats()
+        self._conn = sqlite3.connect(path, check_same_thread=False) # Can be used from pipeline threads, see CardGenerator.runPipeline()
+        self._conn.executescript(SCHEMA)
+        self.db = _FakeDB(self._conn, self.stats)
+        self.models = _FakeModels(self)
+        self.decks = _FakeDecks(self)
+        self.media = _FakeMedia(self)
+        self._next_id = max(int(time.time() * 1000), # IDs are millisecond timestamps like in Anki
+                            self._conn.execute("select max(id) from notes").fetchone()[0] or 0,
+                            self._conn.execute("select max(id) from cards").fetchone()[0] or 0)
+        row = self._conn.execute("select models, decks from col").fetchone()
+        if row:
+            self.models.load(json.loads(row[0]))
+            self.decks.load(json.loads(row[1]))
+        else: # New collection, only has stock note type and deck
+            self.models.add(self.models.newBasic())
+            self.decks.load({"1": "Default"})
+
+    def _newId(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    @_recorded
+    def close(self):
+        self._conn.execute("insert or replace into col values (1, ?, ?)",
+                           (json.dumps(self.models.dump()), json.dumps(self.decks.dump())))
+        self._conn.commit()
+        self._conn.close()
+        self.media.close()
+
+    def save(self): # Saving is automatic in Anki too
+        pass
+
+    @_recorded
+    def new_note(self, model: dict) -> "Note":
+        return Note(self, model)
+
+    @_recorded
+    def get_note(self, nid: int) -> "Note":
+        return Note(self, id=nid)
+
+    @_recorded
+    def add_note(self, note: "Note", deck_id: int):
+        self._insertNotes([(note, deck_id)])
+
+    @_recorded
+    def add_notes(self, requests: Iterable[AddNoteRequest]):
+        self._insertNotes([(request.note, request.deck_id) for request in requests])
+
+    def _insertNotes(self, requests: list[tuple["Note", int]]):
+        note_rows = []
+        card_rows = []
+        for note, deck_id in requests:
+            note.id = self._newId()
+            note_rows.append((note.id, note.guid, note.mid, _joinTags(note.tags), "\x1f".join(note.fields)))
+            for template in self.models.get(note.mid)["tmpls"]: # One card per template
+                card_rows.append((self._newId(), note.id, deck_id, template["ord"]))
+        with self._conn:
+            self._conn.executemany("insert into notes values (?, ?, ?, ?, ?)", note_rows)
+            self._conn.executemany("insert into cards (id, nid, did, ord) values (?, ?, ?, ?)", card_rows)
+
+    @_recorded
+    def update_notes(self, notes: Iterable["Note"]):
+        with self._conn:
+            self._conn.executemany("update notes set tags = ?, flds = ? where id = ?",
+                                   [(_joinTags(note.tags), "\x1f".join(note.fields), note.id) for note in notes])
+
+    @_recorded
+    def remove_notes(self, note_ids: Iterable[int]):
+        note_ids = list(note_ids)
+        with self._conn:
+            self._conn.executemany("delete from cards where nid = ?", [(nid,) for nid in note_ids])
+            self._conn.executemany("delete from notes where id = ?", [(nid,) for nid in note_ids])
+
+    @_recorded
+    def remove_notes_by_card(self, card_ids: Iterable[int]):
+        note_ids = {self._conn.execute("select nid from cards where id = ?", (cid,)).fetchone()[0] for cid in card_ids}
+        self.remove_notes(note_ids)
+
+    @_recorded
+    def set_deck(self, card_ids: Iterable[int], deck_id: int):
+        with self._conn:
+            self._conn.executemany("update cards set did = ? where id = ?", [(deck_id, cid) for cid in card_ids])
+
+    @_recorded
+    def card_ids_of_note(self, nid: int) -> list[int]:
+        return [row[0] for row in self._conn.execute("select id from cards where nid = ? order by ord", (nid,))]
+
+    @_recorded
+    def find_cards(self, query: str) -> list[int]:
+        where, params = self._parseSearch(query)
+        return [row[0] for row in self._conn.execute(
+            F"select c.id from cards c join notes n on n.id = c.nid where {where} order by c.id", params)]
+
+    @_recorded
+    def find_notes(self, query: str) -> list[int]:
+        where, params = self._parseSearch(query)
+        return [row[0] for row in self._conn.execute(
+            F"select distinct n.id from cards c join notes n on n.id = c.nid where {where} order by n.id", params)]
+
+    @_recorded
+    def note_count(self) -> int:
+        return self._conn.execute("select count() from notes").fetchone()[0]
+
+    @_recorded
+    def card_count(self) -> int:
+        return self._conn.execute("select count() from cards").fetchone()[0]
+
+    def _parseSearch(self, query: str) -> tuple[str, list]:
+        """
+        Converts a search in Anki's syntax into an SQL condition on cards c joined with notes n
+        Only supports tag: and deck: terms combined with implicit AND, OR, negation and parentheses
+        """
+        clauses = []
+        params = []
+        for token in SEARCH_TOKEN_RE.findall(query):
+            if token in ["(", ")"]:
+                if token == "(" and clauses and clauses[-1] not in ["(", " or "]:
+                    clauses.append(" and ")
+                clauses.append(token)
+                continue
+            if token.lower() == "or":
+                clauses.append(" or ")
+                continue
+            negate = token.startswith("-")
+            term = token.lstrip("-").strip('"')
+            if term.lower().startswith("tag:"):
+                clause = "n.tags like ? escape '\\'"
+                params.append("% " + _escapeLike(term[4:]).replace("*", "%") + " %")
+            elif term.lower().startswith("deck:"):
+                deck_ids = self.decks.idsUnder(term[5:])
+                clause = F"c.did in ({','.join(str(did) for did in deck_ids)})" if deck_ids else "0" # Negating "in (null)" wouldn't match either
+            else:
+                raise ValueError(F"FakeCollection search does not support {token!r}")
+            if clauses and clauses[-1] not in ["(", " or "]:
+                clauses.append(" and ")
+            clauses.append(F"not ({clause})" if negate else clause)
+        return "".join(clauses) or "1", params
+
+
+class Note:
+    """
+    Stand-in for anki.notes.Note
+    """
+    def __init__(self, col: FakeCollection, model: dict | None = None, id: int | None = None):
+        self.col = col
+        if id:
+            self.id = id
+            self.guid, self.mid, tags, flds = col._conn.execute("select guid, mid, tags, flds from notes where id = ?", (id,)).fetchone()
+            self.tags: list[str] = tags.split()
+            self.fields: list[str] = flds.split("\x1f")
+        else:
+            self.id = 0
+            self.guid = base91(random.randint(0, 2**64 - 1))
+            self.mid = model["id"]
+            self.tags = []
+            self.fields = [""] * len(model["flds"])
+
+    def note_type(self) -> dict:
+        return self.col.models.get(self.mid)
+
+    def add_tag(self, tag: str):
+        self.tags.append(tag)
+
+    def card_ids(self) -> list[int]:
+        return self.col.card_ids_of_note(self.id)
+
+    def _field_index(self, name: str) -> int:
+        return self.col.models.field_names(self.note_type()).index(name)
+
+    def __getitem__(self, name: str) -> str:
+        return self.fields[self._field_index(name)]
+
+    def __setitem__(self, name: str, value: str):
+        self.fields[self._field_index(name)] = value
+
+
+class _FakeDB:
+    """
+    Stand-in for collection.db, runs queries directly on the collection's SQLite file
+    """
+    def __init__(self, conn: sqlite3.Connection, stats: CallStats):
+        self._conn = conn
+        self.stats = stats
+
+    @_recorded
+    def execute(self, sql: str, *args) -> list[tuple]:
+        return self._conn.execute(sql, args).fetchall()
+
+    @_recorded
+    def all(self, sql: str, *args) -> list[tuple]:
+        return self._conn.execute(sql, args).fetchall()
+
+    @_recorded
+    def list(self, sql: str, *args) -> list:
+        return [row[0] for row in self._conn.execute(sql, args)]
+
+    @_recorded
+    def scalar(self, sql: str, *args):
+        row = self._conn.execute(sql, args).fetchone()
+        return row[0] if row else None
+
+
+class _FakeModels:
+    """
+    Stand-in for collection.models, note types are dicts laid out like Anki's
+    """
+    def __init__(self, col: FakeCollection):
+        self.col = col
+        self.stats = col.stats
+        self._models: dict[int, dict] = {}
+
+    def load(self, models: dict[str, dict]):
+        self._models = {int(mid): model for mid, model in models.items()}
+
+    def dump(self) -> dict[str, dict]:
+        return {str(mid): model for mid, model in self._models.items()}
+
+    def newBasic(self) -> dict:
+        model = self.new("Basic")
+        for field_name in ["Front", "Back"]:
+            self.add_field(model, self.new_field(field_name))
+        template = self.new_template("Card 1")
+        template["qfmt"] = "{{Front}}"
+        template["afmt"] = "{{FrontSide}}\n\n<hr id=answer>\n\n{{Back}}"
+        self.add_template(model, template)
+        return model
+
+    @_recorded
+    def get(self, mid: int) -> dict | None:
+        return self._models.get(mid)
+
+    @_recorded
+    def by_name(self, name: str) -> dict | None:
+        for model in self._models.values():
+            if model["name"] == name:
+                return model
+        return None
+
+    @_recorded
+    def new(self, name: str) -> dict:
+        return {"id": 0, "name": name, "flds": [], "tmpls": [], "css": DEFAULT_CSS}
+
+    def new_field(self, name: str) -> dict:
+        return {"name": name, "ord": None}
+
+    def add_field(self, model: dict, field: dict):
+        field["ord"] = len(model["flds"])
+        model["flds"].append(field)
+
+    def new_template(self, name: str) -> dict:
+        return {"name": name, "ord": None, "qfmt": "", "afmt": ""}
+
+    def add_template(self, model: dict, template: dict):
+        template["ord"] = len(model["tmpls"])
+        model["tmpls"].append(template)
+
+    @_recorded
+    def add(self, model: dict):
+        model["id"] = self.col._newId()
+        self._models[model["id"]] = model
+
+    @_recorded
+    def update_dict(self, model: dict):
+        self._models[model["id"]] = model
+
+    @_recorded
+    def field_names(self, model: dict) -> list[str]:
+        return [field["name"] for field in model["flds"]]
+
+
+class _FakeDecks:
+    """
+    Stand-in for collection.decks, only keeps deck names
+    """
+    def __init__(self, col: FakeCollection):
+        self.col = col
+        self.stats = col.stats
+        self._names: dict[int, str] = {}
+
+    def load(self, decks: dict[str, str]):
+        self._names = {int(did): name for did, name in decks.items()}
+
+    def dump(self) -> dict[str, str]:
+        return {str(did): name for did, name in self._names.items()}
+
+    @_recorded
+    def add_normal_deck_with_name(self, name: str) -> DeckNameId:
+        parts = name.split("::")
+        for depth in range(1, len(parts) + 1): # Parents are created as well, like in Anki
+            deck_name = "::".join(parts[:depth])
+            if self.id_for_name(deck_name) == None:
+                self._names[self.col._newId()] = deck_name
+        return DeckNameId(name, self.id_for_name(name))
+
+    @_recorded
+    def id_for_name(self, name: str) -> int | None:
+        for did, deck_name in self._names.items():
+            if deck_name.lower() == name.lower():
+                return did
+        return None
+
+    @_recorded
+    def name(self, did: int) -> str:
+        return self._names[did]
+
+    @_recorded
+    def all_names_and_ids(self) -> list[DeckNameId]:
+        return sorted((DeckNameId(name, did) for did, name in self._names.items()), key=lambda deck: deck.name)
+
+    def idsUnder(self, name: str) -> list[int]:
+        """
+        Ids of deck and its subdecks, for deck: searches. * matches any characters like in Anki, e.g., "deck:A::*" for subdecks only
+        """
+        name_re = re.compile(".*".join(re.escape(part) for part in name.split("*")) + "(::.*)?", re.IGNORECASE)
+        return [did for did, deck_name in self._names.items() if name_re.fullmatch(deck_name)]
+
+
+class _FakeMedia:
+    """
+    Stand-in for collection.media, files are written to a folder next to the collection like Anki's collection.media
+    """
+    def __init__(self, col: FakeCollection):
+        self.col = col
+        self.stats = col.stats
+        if col.path == ":memory:":
+            self._dir = tempfile.mkdtemp(suffix=".media")
+            self._temporary = True
+        else:
+            self._dir = os.path.splitext(col.path)[0] + ".media"
+            self._temporary = False
+            os.makedirs(self._dir, exist_ok=True)
+        self.trash: list[str] = [] # Trashed filenames, Anki moves these into a trash folder
+
+    def dir(self) -> str:
+        return self._dir
+
+    @_recorded
+    def write_data(self, desired_fname: str, data: bytes) -> str:
+        fpath = os.path.join(self._dir, desired_fname)
+        if os.path.exists(fpath):
+            with open(fpath, "rb") as file:
+                if file.read() == data: # Already stored
+                    return desired_fname
+            root, ext = os.path.splitext(desired_fname) # Different content, store under a new name like Anki does
+            desired_fname = F"{root}-{hashlib.sha1(data).hexdigest()}{ext}"
+            fpath = os.path.join(self._dir, desired_fname)
+        with open(fpath, "wb") as file:
+            file.write(data)
+        return desired_fname
+
+    @_recorded
+    def have(self, fname: str) -> bool:
+        return os.path.exists(os.path.join(self._dir, fname))
+
+    @_recorded
+    def trash_files(self, fnames: list[str]):
+        for fname in fnames:
+            os.remove(os.path.join(self._dir, fname))
+            self.trash.append(fname)
+
+    def close(self):
+        if self._temporary:
+            shutil.rmtree(self._dir, ignore_errors=True)
+
+#%% Functions
+
+def base91(num: int) -> str:
+    """
+    Same encoding as anki.utils.base91, used for note GUIDs
+    """
+    buf = ""
+    while num:
+        num, mod = divmod(num, len(BASE91_CHARS))
+        buf = BASE91_CHARS[mod] + buf
+    return buf
+
+def _joinTags(tags: list[str]) -> str:
+    unique = list(dict.fromkeys(tags)) # Duplicates are stripped on save like in Anki
+    return " " + " ".join(unique) + " " if unique else ""
+
+def _escapeLike(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
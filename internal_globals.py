@@ -7,9 +7,14 @@ from collections.abc import Iterable
 
 #%% Constants
 
-PROFILE_HOME = os.path.expanduser(R"~\AppData\Roaming\Anki2\User 1")
-CPATH = os.path.join(PROFILE_HOME, "collection.anki2")
-MPATH = os.path.join(PROFILE_HOME, "collection.media")
+# Environment variables allow other profiles and platforms, e.g., for CI
+PROFILE_HOME = os.environ.get("ANKI_PROFILE", os.path.expanduser(R"~\AppData\Roaming\Anki2\User 1"))
+CPATH = os.environ.get("ANKI_CPATH", os.path.join(PROFILE_HOME, "collection.anki2"))
+MPATH = os.environ.get("ANKI_MPATH", os.path.join(PROFILE_HOME, "collection.media"))
+ANKI_BACKEND = os.environ.get("ANKI_BACKEND", "anki") # "anki" for the real collection, "fake" for fake_anki.FakeCollection
+FAKE_CPATH = os.environ.get("ANKI_CPATH", ":memory:") # Collection of the fake backend, never the profile unless ANKI_CPATH points there
+IMG_PREFIX = "autogen_" # Marks images written by the renderer so that orphans can be garbage collected
+DEFAULT_CSS = ".card {\n    font-family: arial;\n    font-size: 20px;\n    line-height: 1.5;\n    text-align: center;\n    color: black;\n    background-color: white;\n}\n" # Anki's default note type styling, for note types created without a collection
 
 FLAG_EMPTY = "EmptyMain"
 FLAG_PIORITY1 = "Priority1"
@@ -2,8 +2,10 @@
 import os, sys
 # Internal modules
 # from . import cardarbiter
-from cardgenerator import CardGenerator
-from anki_api import reportCollection
+from cardgenerator import CardGenerator, findPages, genStreams
+from renderer import InlineMediaSink, BufferedMediaSink
+from anki_api import reportCollection, openCollection, addCardsFromStreams, ANKICONNECT_URL
+from fake_anki import FakeCollection
 
 #### RUNTIME CONSTANTS AND OTHER SETTINGS stored in globals.py
 
@@ -13,6 +15,11 @@ os.chdir(os.path.dirname(ROOT_PATH)) # cd to directory of main.py file
 XML_PAGE_PATH = R"data\page_xml.xml"
 XML_OUTL_PATH = R"data\outline_xml.xml"
 HTML_PREVIEW_PATH = R"data\displayCards_output.html"
+HTML_PAGE_SIZE = 500 # Cards per preview page, HTML_PREVIEW_PATH becomes an index of pages
+APKG_PATH = R"data\cards.apkg"
+JSONL_PATH = R"data\notes.jsonl"
+BATCH_PAGES = R"data\pages" # Directory or glob of page exports for batch mode, can be passed as argument instead
+BATCH_STREAM_DIR = R"data\streams" # Note stream of each page in batch mode
 
 DEV = 1
     
@@ -32,26 +39,100 @@ if len(sys.argv) > 1: # If arguments are passed via CMD:
         REPLACE = True
     else:
         REPLACE = False
+    if "sync" in sys.argv: # Update existing cards in place, takes precedence over add
+        SYNC = True
+    else:
+        SYNC = False
+    if "diff" in sys.argv: # Print changes to existing cards, other Anki modes only run if something changed
+        DIFF = True
+    else:
+        DIFF = False
+    if "apkg" in sys.argv: # Write cards into APKG_PATH for importing instead of opening the collection
+        APKG = True
+    else:
+        APKG = False
+    if "jsonl" in sys.argv: # Also write notes and images into JSONL_PATH, import with: python anki_api.py import data\notes.jsonl
+        JSONL = True
+    else:
+        JSONL = False
+    if "connect" in sys.argv: # Add cards through AnkiConnect so that Anki can stay open
+        CONNECT = True
+    else:
+        CONNECT = False
+    if "batch" in sys.argv: # Render every page in BATCH_PAGES in parallel, then add all cards (with add) in page order
+        BATCH = True
+        BATCH_PAGES = next((arg for arg in sys.argv[1:] if os.path.isdir(arg) or any(c in arg for c in "*?[")), BATCH_PAGES)
+    else:
+        BATCH = False
+    if "compact" in sys.argv:
+        COMPACT = True
+    else:
+        COMPACT = False
+    if "context" in sys.argv: # Context in its own note field for inline styled cards too, compact cards always have it
+        CONTEXT = True
+    else:
+        CONTEXT = None
         
 if DEV: # Dev mode for running directly from Python
     HTML = True # Display HTML output 
     ADD = True # Actually add cards to Anki
     REPLACE = True
+    SYNC = False
+    DIFF = False
+    APKG = False
+    JSONL = False
+    CONNECT = False
+    BATCH = False
+    COMPACT = False # Class styled cards on dedicated note type
+    CONTEXT = None # Context in its own note field, None to follow COMPACT
     
 
 #%% 
-if __name__ == "__main__":
-
-    crawler = CardGenerator(XML_PAGE_PATH, XML_OUTL_PATH)
-    crawler.genNotes()
-    if HTML:
-        crawler.displayCards(HTML_PREVIEW_PATH)
+if __name__ == "__main__" and BATCH: # Outline is parsed once for all pages, each page gets its own note stream
+    stream_paths = genStreams(findPages(BATCH_PAGES), XML_OUTL_PATH, BATCH_STREAM_DIR, compact=COMPACT, context_field=CONTEXT)
     if ADD:
-        crawler.addCards(replace=REPLACE)
-        
-        
+        with openCollection() as col: # Single writer, streams are read in page order
+            addCardsFromStreams(stream_paths, replace=REPLACE, col_open=col)
+            if isinstance(col, FakeCollection):
+                print(col.stats)
 
-    if DEV: # Report deck information after adding cards
-        reportCollection()
+elif __name__ == "__main__":
 
+    if HTML and not (ADD or SYNC or DIFF or APKG or JSONL): # Preview only, embed images in preview HTML instead of writing them into Anki media folder
+        crawler = CardGenerator(XML_PAGE_PATH, XML_OUTL_PATH, media=InlineMediaSink(), compact=COMPACT, context_field=CONTEXT)
+    else: # Images are registered with Anki's media manager when adding cards, or packed into the .apkg file or note stream
+        crawler = CardGenerator(XML_PAGE_PATH, XML_OUTL_PATH, media=BufferedMediaSink(), compact=COMPACT, context_field=CONTEXT)
+    
+    # Notes are streamed into each output while later entry points are still rendering
+    sinks = []
+    if HTML:
+        sinks.append(lambda notes: crawler.displayCards(HTML_PREVIEW_PATH, HTML_PAGE_SIZE, notes))
+    if JSONL:
+        sinks.append(lambda notes: crawler.writeJsonl(JSONL_PATH, notes))
+    if SYNC or DIFF or APKG: # Need all notes at once
+        sinks.append(crawler.notes.extend)
+    
+    if ADD and CONNECT and not (SYNC or DIFF): # Sync and diff need direct access to the collection
+        sinks.append(lambda notes: crawler.addCards(replace=REPLACE, connect_url=ANKICONNECT_URL, notes=notes))
+        crawler.runPipeline(sinks)
+    elif SYNC or ADD or DIFF:
+        with openCollection() as col: # Collection is opened once for the whole run
+            if ADD and not (SYNC or DIFF): # Cards are inserted while rendering continues
+                sinks.append(lambda notes: crawler.addCards(replace=REPLACE, col_open=col, notes=notes))
+            crawler.runPipeline(sinks)
+            
+            if DIFF and crawler.diffCards(col).isEmpty(): # Nothing to import
+                pass
+            elif SYNC:
+                crawler.syncCards(col)
+            elif ADD and DIFF:
+                crawler.addCards(replace=REPLACE, col_open=col)
 
+            if DEV: # Report deck information after adding cards
+                reportCollection(col)
+            if isinstance(col, FakeCollection): # Benchmarking without Anki, e.g., in CI
+                print(col.stats)
+    else:
+        crawler.runPipeline(sinks)
+    if APKG:
+        crawler.writePackage(APKG_PATH)
@@ -11,9 +11,6 @@ from urllib.parse import quote
 # General
 from bs4 import BeautifulSoup
 
-# Anki
-from anki.storage import Collection
-
 # Internal 
 from internal_globals import FLAG_EMPTY, FLAG_PIORITY1, FLAG_IGNORE, FLAG_RECIGNORE
 
@@ -7,6 +7,7 @@ from collections.abc import Iterable
 from xml.etree import ElementTree
 from xml.etree.ElementTree import Element
 import base64
+from functools import lru_cache
 
 # General
 from bs4 import BeautifulSoup
@@ -16,12 +17,26 @@ import lxml.etree as ET
 
 # Internal modules
 # from . import internal_globals
-from internal_globals import MPATH, FLAG_EMPTY, FLAG_PIORITY1
+from internal_globals import MPATH, IMG_PREFIX, FLAG_EMPTY, FLAG_PIORITY1
 from onenote import OENodeHeader, OENodePoint
 
 #%% Constants
 GRAY = "#e8e8e8" # Can set to empty string to insert nothing
 IMG_STYLING = "style='max-width:600px'"
+SIBLING_WINDOW = None # Max number of siblings rendered on each side of the entry point, rest are elided. None to render all
+ANCESTOR_DEPTH = None # Max number of parent nodes wrapped around the entry point. None to render all
+
+# Compact output - class names replace inline styles, COMPACT_CSS needs to be set as the note type styling
+COMPACT_CLASSES = {"bold": "b", "underline": "u", "italic": "i"} 
+COMPACT_CSS = f"""
+.c {{font-family:Calibri; color:#000000;}}
+.b {{font-weight:bold;}}
+.u {{text-decoration:underline;}}
+.i {{font-style:italic;}}
+li.k {{color:#000000;}}
+.g {{color:{GRAY};}}
+img {{max-width:600px;}}
+"""
 
 #%% Classes
 class StandardRenderer:
@@ -30,18 +45,41 @@ class StandardRenderer:
     Acts as storage hub for information input/output for renderer functions
     """
     # FIXME - Move this portion to main so that you can type without circular import
-    def __init__(self, node: OENodePoint):        
+    def __init__(self, node: OENodePoint, 
+                 media: Union["MediaDirSink", "InlineMediaSink", None] = None,
+                 cache: Union["RenderCache", None] = None,
+                 compact: bool = False,
+                 sibling_window: int | None = SIBLING_WINDOW,
+                 ancestor_depth: int | None = ANCESTOR_DEPTH,
+                 context_field: bool | None = None):        
+        """
+        compact: Style elements with short class names defined in COMPACT_CSS instead of inline styles,
+        cards then need a note type with COMPACT_CSS as its styling
+        context_field: Keep page/header context in contexthtml rather than prepending it to fronthtml and backhtml,
+        cards then need a note type with a field for the context. None to follow compact
+        sibling_window: Max number of siblings rendered on each side of the entry point, the rest are replaced by a marker
+        ancestor_depth: Max number of parent nodes wrapped around the entry point, starting from the closest
+        """
         self.node = node # Is an instance of OENodePoint, the entry point node
+        self.compact = compact # Options should be the same for all renderers sharing a cache
+        self.sibling_window = sibling_window
+        self.ancestor_depth = ancestor_depth
+        self.context_field = compact if context_field == None else context_field
+        self.media = media or MediaDirSink() # Destination of rendered images, defaults to Anki media folder
+        self.cache = cache or RenderCache() # Share a single cache between renderers of the same run to reuse fragments
         self.fronthtml = ""
         self.backhtml = ""
-        self.img_count_child = 0 # Image counter for each card to assign each image a unique identifier 
-        self.img_count_sibling = 0 # Separate image counter for sibling to avoid interference with direct child images
+        self.contexthtml = "" # Only populated with context_field
+        self._front = HtmlFragment() # Working trees, serialized into fronthtml/backhtml once rendering is done
+        self._back = HtmlFragment()
         
     
     
     def renderHtml(self):
         self._renderHtmlMain() # Render nodes
         self._renderHtmlParents() # Render context HTML wrapping around nodes
+        self.fronthtml = str(self._front) # Single serialization of the assembled trees
+        self.backhtml = str(self._back)
     
     def _renderHtmlMain(self):
         """
@@ -52,102 +90,232 @@ class StandardRenderer:
         # Add parent node rendering here or in a separate function
         sibling_nodes_imgs: list[OENodePoint] = []
         
-        front = "<ul>\n" # Open list for sibling nodes
-        back = "<ul>\n" # Open list for sibling nodes
-        for node in self.node.sibling_nodes:
-            func = FUNCMAP[node.type] # Retrieve relevant function based on node type
+        front = HtmlFragment("<ul>\n") # Open list for sibling nodes
+        back = HtmlFragment("<ul>\n") # Open list for sibling nodes
+        
+        sibling_nodes = self.node.sibling_nodes
+        elided_after = 0
+        if self.sibling_window != None: # Bound card size for large groups by only rendering siblings closest to entry point
+            position = self._siblingPosition()
+            start = max(position - self.sibling_window, 0)
+            end = position + self.sibling_window + 1
+            elided_after = max(len(sibling_nodes) - end, 0)
+            sibling_nodes = sibling_nodes[start:end]
+            if start:
+                front += _renderElided(start, self.compact)
+                back += _renderElided(start, self.compact)
+        
+        for node in sibling_nodes:
             if self.node.id == node.id: # Node reponsible for entrypoint and caller of StandardRenderer
-                front += func(node=node, front=True, level="entry", renderer=self)
-                back += func(node=node, front=False, level="entry", renderer=self)
+                node_front, node_back = self.renderNode(node, level="entry")
+                front += node_front
+                back += node_back
                 
                 if node.children_nodes: # Render direct children nodes
-                    child_front = "\n<ul>\n" # Open list for direct children nodes
-                    child_back = "\n<ul>\n" # Open list for direct children nodes
+                    child_front = HtmlFragment("\n<ul>\n") # Open list for direct children nodes
+                    child_back = HtmlFragment("\n<ul>\n") # Open list for direct children nodes
                     for child_node in node.children_nodes: 
-                        cfunc = FUNCMAP[child_node.type] # Refetch relevant function for child node (otherwise will use parent type)
-                        child_front += cfunc(node=child_node, front=True, level="direct_child", renderer=self) 
-                        child_back += cfunc(node=child_node, front=False, level="direct_child", renderer=self)
+                        cfront, cback = self.renderNode(child_node, level="direct_child")
+                        child_front += cfront
+                        child_back += cback
                     child_front += "</ul>\n" # Close list for direct children nodes
                     child_back += "</ul>\n" # Close list for direct children nodes
-                    front = _insertSubstring(front, "</li>", child_front) # Insert back into started list
-                    back = _insertSubstring(back, "</li>", child_back)
+                    front = _nestHtml(front, child_front) # Insert back into started list
+                    back = _nestHtml(back, child_back)
                 # Children rendering handled by rendering functions, CardArbiter class handles recursive card creation hence rendering can do its own thing
             elif node.type != "image": # Render non-image nodes in order
-                front += func(node=node, front=True, level="sibling", renderer=self) 
-                back += func(node=node, front=False, level="sibling", renderer=self)
+                node_front, node_back = self.renderNode(node, level="sibling")
+                front += node_front
+                back += node_back
                 # No need for children parsing for sibling nodes
             elif node.type == "image": # Store image nodes to be rendered last
                 sibling_nodes_imgs.append(node) 
+        
+        if elided_after:
+            front += _renderElided(elided_after, self.compact)
+            back += _renderElided(elided_after, self.compact)
                 
         for node in sibling_nodes_imgs: # Render images at end 
-            func = FUNCMAP[node.type]
-            front += func(node=node, front=True, level="sibling", renderer=self) 
-            back += func(node=node, front=False, level="sibling", renderer=self)         
+            node_front, node_back = self.renderNode(node, level="sibling")
+            front += node_front
+            back += node_back
         
         front += "</ul>\n" # Close list for sibling nodes
         back += "</ul>\n" # Close list for sibling nodes
         
-        self.fronthtml += front
-        self.backhtml += back
+        self._front += front
+        self._back += back
         return self
     
     def _renderHtmlParents(self):
         """
         Render parent nodes for entry node and add it to the generated HTML
+        Context only depends on the header and ancestor chain of the entry point, hence is built once and reused between cards
         """
-        
         # Parent node rendering
-        for parent_node in self.node.parent_nodes: # Convert parent nodes into OENodePoint instances
-            # Note that each node is wrapped around old node, furthest parent node is added last
-            pfront = "<ul>\n" # Open list for parent node
-            pback = "<ul>\n"
-            # Make list item
-            if self.node.type in ["grouping"] and parent_node.id == self.node.parent_nodes[0].id: # Checks if the parent node is the most immediate to entry point; if so, does special processing of immediate parent node if entry point is a grouping
-                if parent_node.type in ["concept"]:
-                    pfront += _genHtmlElement(parent_node.stem, ["bold"], "", li=True, bullet=parent_node.bullet_data)
-                    pback += _genHtmlElement(parent_node.data, [], "", li=True, bullet=parent_node.bullet_data)
-                elif parent_node.type in ["grouping"]:
-                    pfront += _genHtmlElement(parent_node.stem, ["underline"], "", li=True, bullet=parent_node.bullet_data)
-                    pback += _genHtmlElement(parent_node.data, [], "", li=True, bullet=parent_node.bullet_data)
-            else: # Treat as a distant parent node
-                if parent_node.type in ["concept"]:
-                    pfront += _genHtmlElement(parent_node.stem, ["bold"], GRAY, li=True, bullet=parent_node.bullet_data)
-                    pback += _genHtmlElement(parent_node.data, [], GRAY, li=True, bullet=parent_node.bullet_data)
-                elif parent_node.type in ["grouping"]:
-                    pfront += _genHtmlElement(parent_node.stem, ["underline"], GRAY, li=True, bullet=parent_node.bullet_data)
-                    pback += _genHtmlElement(parent_node.data, [], GRAY, li=True, bullet=parent_node.bullet_data)
-            pfront += "</ul>\n" # Close list for parent node (should only have 1 item), next level will have its own list
-            pback += "</ul>\n"
-            
-            self.fronthtml = _insertSubstring(pfront, "</li>", "\n" + self.fronthtml) # Wrap new HTML around previous HTML by inserting old into new
-            self.backhtml = _insertSubstring(pback, "</li>", "\n" + self.backhtml) # Most generated HTML elements will have \n at end so won't need to add one
-
-        # Instantiate parent addon HTML
+        if self.node.parent_nodes and self.ancestor_depth != 0:
+            immediate = self.node.type in ["grouping"] # Immediate parent of a grouping entry point doesn't get grayed out
+            (front_open, front_close), (back_open, back_close) = self._wrapParents(self.node.parent_nodes[0], immediate, self.ancestor_depth)
+            self._front = HtmlFragment(front_open, self._front, front_close) if front_close != None else HtmlFragment(front_open)
+            self._back = HtmlFragment(back_open, self._back, back_close) if back_close != None else HtmlFragment(back_open)
+
+        # Add header rendering to front of HTML
         header = self.node.parent_headers[0] # Retrieve immediate header of the entry point
-        parents_html = header.page_title
-        
-        # Parent page rendering - Added first to addon HTML
-        for page in header.parent_pages: # Container of XML Elements for parent pages
-            parents_html += f" - {page.get('name')}"
-        parents_html = _genHtmlElement(parents_html, ["italic"], GRAY) + "<br>\n" # Initialize HTML with title and newline 
-        
+        if header not in self.cache.headers:
+            self.cache.headers[header] = _renderBreadcrumb(header, self.compact)
+        if self.context_field: # Stored once in a separate field which note type shows on both sides
+            self.contexthtml = self.cache.headers[header]
+        else:
+            self._front = HtmlFragment(self.cache.headers[header], self._front)
+            self._back = HtmlFragment(self.cache.headers[header], self._back)
         
-        # Parent header rendering
-        first_header =  f"<a href='{header.link}' style='color:{GRAY}'>" + header.text + "</a>" # Hyperlink first header
-        parents_html += _genHtmlElement(f"[{first_header}]", ["underline"], GRAY) # Add itself as the immediate header
-        for pheader in header.parent_headers: # Add headers and links to respective element
-            parents_html += f" - [{pheader.text}]"
-        parents_html = _genHtmlElement(parents_html, [], GRAY) + "<br><br>\n" # Wrapped HTML with gray styling span 
+        return self
+    
+    def _wrapParents(self, parent_node: OENodePoint, immediate: bool = False, depth: int | None = None) -> tuple[tuple[str, str | None], tuple[str, str | None]]:
+        """
+        Returns opening and closing HTML for front and back which wrap content into parent_node and all of its ancestors (furthest parent outermost)
+        Closing is None if a wrapper has no list item to insert into, content is then discarded and opening is the entire HTML
+        depth: Number of nodes to wrap including parent_node, None for all ancestors
+        Cached per node since a node always has the same ancestors
+        """
+        key = (parent_node, immediate, depth)
+        if key in self.cache.parents:
+            return self.cache.parents[key]
         
-        # Add header rendering to front of HTML
-        self.fronthtml = parents_html + self.fronthtml 
-        self.backhtml = parents_html + self.backhtml
+        front, back = _renderParentNode(parent_node, immediate, self.compact)
+        wrappers = (_splitWrapper(front), _splitWrapper(back))
+        if parent_node.parent_nodes and (depth == None or depth > 1): # Wrap around this parent using the cached wrappers of its own parent
+            outer_front, outer_back = self._wrapParents(parent_node.parent_nodes[0], depth=None if depth == None else depth - 1)
+            wrappers = (_joinWrappers(outer_front, wrappers[0]), _joinWrappers(outer_back, wrappers[1]))
         
-        return self
+        self.cache.parents[key] = wrappers
+        return wrappers
+    
+    def _siblingPosition(self) -> int:
+        """
+        Returns index of entry point among its siblings, indexed once per group of siblings
+        """
+        if self.node not in self.cache.positions:
+            for position, node in enumerate(self.node.sibling_nodes):
+                self.cache.positions[node] = position
+        return self.cache.positions[self.node]
+    
+    def renderNode(self, node: OENodePoint, level: str) -> "RenderPair":
+        """
+        Renders front and back of a node using the function resolved for it from its type and indicators
+        Sibling and direct child renderings don't depend on the entry point, hence are cached and reused for the rest of the run
+        """
+        if node not in self.cache.funcs: # Resolve once per node
+            self.cache.funcs[node] = _resolveRenderFunc(node)
+        func = self.cache.funcs[node]
+        if level == "entry": # Unique to each card, no point in caching
+            return func(node=node, level=level, renderer=self)
+        key = (node, level)
+        if key not in self.cache.fragments:
+            front, back = func(node=node, level=level, renderer=self)
+            self.cache.fragments[key] = (str(front), str(back)) # Store serialized HTML so that nesting into a card can't modify cached fragment
+        return self.cache.fragments[key]
     
     def _resetHtml(self):
         self.fronthtml = ""
         self.backhtml = ""
+        self.contexthtml = ""
+        self._front = HtmlFragment()
+        self._back = HtmlFragment()
+
+class RenderCache:
+    """
+    Storage shared between StandardRenderer instances of a single run
+    Entries are only valid for the node tree they were rendered from
+    """
+    def __init__(self):
+        self.fragments: dict[tuple[OENodePoint, str], tuple[str, str]] = {} # (node, level) -> rendered front and back HTML
+        self.parents: dict[tuple[OENodePoint, bool, int | None], tuple[tuple[str, str | None], tuple[str, str | None]]] = {} # (parent node, immediate, depth) -> wrapping HTML for front and back
+        self.positions: dict[OENodePoint, int] = {} # Node -> index among its siblings
+        self.headers: dict[OENodeHeader, str] = {} # Header -> page and header breadcrumb HTML
+        self.funcs: dict[OENodePoint, Callable] = {} # Node -> rendering function resolved from type and indicators
+
+class HtmlFragment:
+    """
+    Lightweight tree of HTML pieces for assembling cards 
+    Parts are str or nested HtmlFragment instances attached by reference, the whole tree is serialized once via str()
+    Avoids copying the accumulated HTML every time something is appended or inserted into it
+    """
+    __slots__ = ("parts",)
+    
+    def __init__(self, *parts: Union[str, "HtmlFragment"]):
+        self.parts: list[Union[str, HtmlFragment]] = [p for p in parts if p] # Empty parts have no effect on output
+    
+    def __iadd__(self, part: Union[str, "HtmlFragment"]):
+        if part:
+            self.parts.append(part)
+        return self
+    
+    def __bool__(self): # Parts are never empty strings, hence only need to check for nested parts
+        return any(self.parts)
+    
+    def __str__(self):
+        html = []
+        stack = [iter(self.parts)] # Iterative traversal to avoid recursion limits on deeply nested cards
+        while stack:
+            for part in stack[-1]:
+                if isinstance(part, HtmlFragment):
+                    stack.append(iter(part.parts))
+                    break
+                html.append(part)
+            else: # Exhausted current level
+                stack.pop()
+        return "".join(html)
+    
+    def nest(self, child: Union[str, "HtmlFragment"]) -> bool:
+        """
+        Inserts child in front of the last closing </li> of the tree, only splitting the str part that contains it
+        Returns False if there is no list item to insert into
+        """
+        for i in range(len(self.parts) - 1, -1, -1): # Search from end 
+            part = self.parts[i]
+            if isinstance(part, HtmlFragment):
+                if part.nest(child):
+                    return True
+            else:
+                ind = part.rfind("</li>")
+                if ind >= 0:
+                    self.parts[i] = HtmlFragment(part[:ind], child, part[ind:])
+                    return True
+        return False
+
+class MediaDirSink:
+    """
+    Writes rendered images into a media directory, HTML references them by filename
+    """
+    def __init__(self, media_dir: Union[str, os.PathLike, None] = None):
+        self.media_dir = media_dir or MPATH # Resolved at instantiation so that MPATH can be overridden
+
+    def store(self, img_name: str, img_data: str) -> str:
+        img_path = os.path.join(self.media_dir, img_name)
+        with open(img_path, "wb") as file:
+            file.write(base64.decodebytes(img_data.encode("utf-8"))) # Convert bytes format to base64 format which is read by write() function
+        return img_name # Value for src attribute
+        
+class InlineMediaSink:
+    """
+    Embeds images into the HTML as data URIs without touching the filesystem
+    For previews, does not hold any state so it can be shared between parallel runs
+    """
+    def store(self, img_name: str, img_data: str) -> str:
+        return "data:image/png;base64," + "".join(img_data.split()) # Image data is already base64, only strip line breaks
+
+class BufferedMediaSink:
+    """
+    Keeps rendered images in memory so that they can be registered with Anki's media manager in one pass after rendering
+    See anki_api.registerMedia()
+    """
+    def __init__(self):
+        self.files: dict[str, bytes] = {} # Filename -> image data
+    
+    def store(self, img_name: str, img_data: str) -> str:
+        self.files[img_name] = base64.decodebytes(img_data.encode("utf-8"))
+        return img_name # Value for src attribute
 
 ##%% Functions
 import inspect
@@ -181,47 +349,146 @@ def _insertSubstring(text: str, substr: str, ins: str, end = True, before = True
     else: # Otherwise, text is an empty string, should return substring instead
         return substr
 
+def _nestHtml(html: HtmlFragment, child: Union[str, HtmlFragment]) -> HtmlFragment:
+    """
+    Fragment equivalent of _insertSubstring(html, "</li>", child)
+    Child is dropped if html has no list item, an empty html becomes a lone "</li>"
+    """
+    if html.nest(child) or html:
+        return html
+    return HtmlFragment("</li>")
+
+
+def _renderParentNode(node: OENodePoint, immediate: bool = False, compact: bool = False) -> tuple[str, str]:
+    """
+    Renders front and back of a parent node as its own single item list, entry point content is later inserted into its list item
+    immediate: Whether node is the immediate parent of a grouping entry point, in which case it isn't grayed out
+    compact: Use class based styling, see _genHtmlElement
+    """
+    color = "" if immediate else GRAY
+    front = "<ul>\n" # Open list for parent node
+    back = "<ul>\n"
+    if node.type in ["concept"]:
+        front += _genHtmlElement(node.stem, ["bold"], color, li=True, bullet=node.bullet_data, compact=compact)
+        back += _genHtmlElement(node.data, [], color, li=True, bullet=node.bullet_data, compact=compact)
+    elif node.type in ["grouping"]:
+        front += _genHtmlElement(node.stem, ["underline"], color, li=True, bullet=node.bullet_data, compact=compact)
+        back += _genHtmlElement(node.data, [], color, li=True, bullet=node.bullet_data, compact=compact)
+    front += "</ul>\n" # Close list for parent node (should only have 1 item), next level will have its own list
+    back += "</ul>\n"
+    return front, back
+
+
+def _renderElided(count: int, compact: bool = False) -> str:
+    """
+    Placeholder list item for siblings left out of a card
+    """
+    return _genHtmlElement(f"... ({count} more)", ["italic"], GRAY, li=True, compact=compact)
+
+
+def _splitWrapper(wrapper: str) -> tuple[str, str | None]:
+    """
+    Splits wrapping HTML at the point where content is inserted (in front of last </li>)
+    Closing is None if there is no list item, mirrors _nestHtml discarding the content in that case
+    """
+    ind = wrapper.rfind("</li>")
+    if ind >= 0:
+        return wrapper[:ind] + "\n", wrapper[ind:] # Most generated HTML elements will have \n at end so won't need to add one
+    return wrapper, None
+
+
+def _joinWrappers(outer: tuple[str, str | None], inner: tuple[str, str | None]) -> tuple[str, str | None]:
+    """
+    Combines two wrappers from _splitWrapper so that content is wrapped by inner first and then by outer
+    """
+    outer_open, outer_close = outer
+    inner_open, inner_close = inner
+    if outer_close == None: # Outer discards everything inside of it
+        return outer_open, None
+    elif inner_close == None: # Inner is constant, hence so is the combined wrapper
+        return outer_open + inner_open + outer_close, None
+    return outer_open + inner_open, inner_close + outer_close
+
+
+def _renderBreadcrumb(header: OENodeHeader, compact: bool = False) -> str:
+    """
+    Renders page and header context which is added to the top of every card under the header
+    compact: Use class based styling, see _genHtmlElement
+    """
+    parents_html = header.page_title
+    
+    # Parent page rendering - Added first to addon HTML
+    for page in header.parent_pages: # Container of XML Elements for parent pages
+        parents_html += f" - {page.get('name')}"
+    parents_html = _genHtmlElement(parents_html, ["italic"], GRAY, compact=compact) + "<br>\n" # Initialize HTML with title and newline 
+    
+    # Parent header rendering
+    link_styling = "class='g'" if compact and GRAY else f"style='color:{GRAY}'"
+    first_header =  f"<a href='{header.link}' {link_styling}>" + header.text + "</a>" # Hyperlink first header
+    parents_html += _genHtmlElement(f"[{first_header}]", ["underline"], GRAY, compact=compact) # Add itself as the immediate header
+    for pheader in header.parent_headers: # Add headers and links to respective element
+        parents_html += f" - [{pheader.text}]"
+    parents_html = _genHtmlElement(parents_html, [], GRAY, compact=compact) + "<br><br>\n" # Wrapped HTML with gray styling span 
+    return parents_html
+
 
 def _convertMath(math_str: str, color: str = "", inline: bool = False) -> str:
     """
     Takes a string and converts any OneNote MathML elements into Tex formatting
     Modified from: https://dev.to/furkan_kalkan1/quick-hack-converting-mathml-to-latex-159c
     """
+    if "<!--[if mathML]>" not in math_str: # Fast path for the vast majority of content without math
+        return math_str
     # Formatting specific to OneNote MathML output
     math_objects: list[str] = re.findall(R"<!\-\-\[if mathML\]>.*?<!\[endif\]\-\->", math_str)
     for original_math in math_objects:
-        math_mml = original_math.replace("<!--[if mathML]>", "").replace("<![endif]-->", "") # Extract mathmml component but leave original 
-        html_tags: list[str] = re.findall("<.*?>", math_mml) # Finds all HTML tags
-        for tag in html_tags: # Iterate through matches to replace namespace component (no easy regex way to do it)
-            new_tag = tag.replace("mml:", "")
-            new_tag = new_tag.replace(":mml", "") # Still need xmlns attribute to use XSLT to parse
-            math_mml = math_mml.replace(tag, new_tag, 1) # Replace first instance of the match with new tag
-    
-        # Exception parsing: For errors due to undefined symbols, can probably find a reference here http://zvon.org/comp/r/ref-MathML_2.html#intro
-        math_mml = math_mml.replace("&nbsp;", "&#x02004;") # nbsp not in XSLT entities, replace with code for 1/3emspace http://zvon.org/comp/r/ref-MathML_2.html#Entities~emsp
-    
-        math_xml = ET.fromstring(math_mml)
-        xslt_table = ET.parse("mml2tex/mmltex.xsl") # This XSL file links to the other other XSL files in the folder
-        transformer = ET.XSLT(xslt_table)
-        math_tex = str(transformer(math_xml)) # Convert transformed output to string
-        c = bool(color) # Variable for branchless string modification
-        if inline: # Format for inline rendering - https://docs.ankiweb.net/math.html
-            # Inline math tends to be replaced with $ signs at beginning and end, will replace these with anki inline rendering indicators
-            math_tex = re.sub(R"^\$ ?", R"\\(" + c*R"{\\color{"+color+c*"}", math_tex) # Branchless adding of beginning tag for color 
-            math_tex = re.sub(R" ?\$$", c*"}" + R"\\)", math_tex) # Branchless adding of closing tag for color 
-        else: # Branchless processing of square brackets for regular inline display
-            math_tex = math_tex.replace("\n\\[", "\n\\[" + c*R"{\color{"+color+c*"}") # Branchless adding of beginning tag for color 
-            math_tex = math_tex.replace("\n\\]", c*"}" + "\n\\]") # Branchless adding of closing tag for color             
+        math_tex = _convertMathObject(original_math, color, inline)
         math_str = math_str.replace(original_math, math_tex) # Replace original found math object with converted tex object
 
     return math_str
 
 
+@lru_cache(maxsize=None)
+def _convertMathObject(original_math: str, color: str = "", inline: bool = False) -> str:
+    """
+    Converts a single OneNote MathML object into Tex
+    Memoized since the same math gets rendered on both sides of a card and in multiple cards
+    """
+    math_mml = original_math.replace("<!--[if mathML]>", "").replace("<![endif]-->", "") # Extract mathmml component but leave original 
+    html_tags: list[str] = re.findall("<.*?>", math_mml) # Finds all HTML tags
+    for tag in html_tags: # Iterate through matches to replace namespace component (no easy regex way to do it)
+        new_tag = tag.replace("mml:", "")
+        new_tag = new_tag.replace(":mml", "") # Still need xmlns attribute to use XSLT to parse
+        math_mml = math_mml.replace(tag, new_tag, 1) # Replace first instance of the match with new tag
+
+    # Exception parsing: For errors due to undefined symbols, can probably find a reference here http://zvon.org/comp/r/ref-MathML_2.html#intro
+    math_mml = math_mml.replace("&nbsp;", "&#x02004;") # nbsp not in XSLT entities, replace with code for 1/3emspace http://zvon.org/comp/r/ref-MathML_2.html#Entities~emsp
+
+    math_xml = ET.fromstring(math_mml)
+    math_tex = str(_getMathTransformer()(math_xml)) # Convert transformed output to string
+    c = bool(color) # Variable for branchless string modification
+    if inline: # Format for inline rendering - https://docs.ankiweb.net/math.html
+        # Inline math tends to be replaced with $ signs at beginning and end, will replace these with anki inline rendering indicators
+        math_tex = re.sub(R"^\$ ?", R"\\(" + c*R"{\\color{"+color+c*"}", math_tex) # Branchless adding of beginning tag for color 
+        math_tex = re.sub(R" ?\$$", c*"}" + R"\\)", math_tex) # Branchless adding of closing tag for color 
+    else: # Branchless processing of square brackets for regular inline display
+        math_tex = math_tex.replace("\n\\[", "\n\\[" + c*R"{\color{"+color+c*"}") # Branchless adding of beginning tag for color 
+        math_tex = math_tex.replace("\n\\]", c*"}" + "\n\\]") # Branchless adding of closing tag for color             
+    return math_tex
+
+
+@lru_cache(maxsize=None)
+def _getMathTransformer() -> ET.XSLT:
+    xslt_table = ET.parse("mml2tex/mmltex.xsl") # This XSL file links to the other other XSL files in the folder, only parsed once
+    return ET.XSLT(xslt_table)
+
+
 def _genHtmlElement(content: str, 
                 style: list[str] = [],
                 color: str = "",
                 li: bool = False,
                 bullet: str = "",
+                compact: bool = False,
                 ) -> str:
     """
     Generates HTML element with a variety of styling options. 
@@ -234,60 +501,86 @@ def _genHtmlElement(content: str,
         style (List[str], optional): List of str for styling options (bold, underline, italic). Defaults to [].
         list (bool, optional): Whether to render the element as a list item, adds <li> and </li> at beginning and end of HTML string. Defaults to False.
         bullet (str, optional): Styling for list item if rendering a list item. Defaults to "". Will have no effect if list=False
+        compact (bool, optional): Use classes from COMPACT_CSS instead of inline styles. Defaults to False. Colors other than GRAY stay inline
 
     Returns:
         str: Final generated HTML element
     """
-    html_item = "" # Initialize HTML container 
+    prefix, suffix = _genHtmlAffixes(tuple(style), color, li, bullet, compact) # Styling only depends on arguments, looked up rather than rebuilt
+    # CONTENT ADDED HERE, add math conversion to all text elements that use genHtmlElement (could also add it durin instantiation but would have less control over it)
+    return prefix + _convertMath(content, color=color, inline=True) + suffix
+
+
+@lru_cache(maxsize=None)
+def _genHtmlAffixes(style: tuple[str, ...] = (),
+                    color: str = "",
+                    li: bool = False,
+                    bullet: str = "",
+                    compact: bool = False,
+                    ) -> tuple[str, str]:
+    """
+    Builds the HTML that goes before and after the content of an element generated by _genHtmlElement
+    Memoized since there are only a handful of style, color and bullet combinations in a page
+    """
+    if compact and (not color or color == GRAY): # Class equivalents of the inline styles below
+        color_class = "g" if color else "" # Color empty means black
+        prefix = ""
+        if li:
+            prefix += " ".join(a for a in ["<li", bullet, f"class='{color_class or 'k'}'"] if a) + ">"
+        classes = ["c"] + [COMPACT_CLASSES[s] for s in ["bold", "underline", "italic"] if s in style] + [color_class]
+        prefix += f"<span class='{' '.join(c for c in classes if c)}'>"
+        suffix = ""
+        if style or color: # Mirror inline styling which leaves default span open
+            suffix += "</span>"
+        if li:
+            suffix += "</li>\n"
+        return prefix, suffix
+    
+    prefix = "" # Initialize HTML container 
     if li:
-        html_item += f"<li {bullet}>"
+        prefix += f"<li {bullet}>"
         if color: # Change color of bullet if there is a color argument passed
-            if "style" in html_item: # If there is a styling element already
-                html_item = _insertSubstring(html_item, "'", f"; color:{color}") # Insert color property in styling element
+            if "style" in prefix: # If there is a styling element already
+                prefix = _insertSubstring(prefix, "'", f"; color:{color}") # Insert color property in styling element
             else:
-                html_item = _insertSubstring(html_item, ">", f"style='color:{color}'") # Create and insert new styling element with color
+                prefix = _insertSubstring(prefix, ">", f"style='color:{color}'") # Create and insert new styling element with color
         else: # Assume color is black
-            if "style" in html_item: # If there is a styling element already
-                html_item = _insertSubstring(html_item, "'", "; color:#000000") # Insert color property in styling element
+            if "style" in prefix: # If there is a styling element already
+                prefix = _insertSubstring(prefix, "'", "; color:#000000") # Insert color property in styling element
             else:
-                html_item = _insertSubstring(html_item, ">", "style='color:#000000'") # Create and insert new styling element with color
-            
-                
+                prefix = _insertSubstring(prefix, ">", "style='color:#000000'") # Create and insert new styling element with color
         
     if style or color: # If style or color arguments not empty, add all applicable options below:
-        html_item += "<span style='" # Open style attribute and span tag
-        html_item += "font-family:Calibri;" # Default Calibri font
+        prefix += "<span style='" # Open style attribute and span tag
+        prefix += "font-family:Calibri;" # Default Calibri font
         if "bold" in style:
-            html_item += "font-weight:bold;"
+            prefix += "font-weight:bold;"
         if "underline" in style:
-            html_item += "text-decoration:underline;"
+            prefix += "text-decoration:underline;"
         if "italic" in style:
-            html_item += "font-style:italic;"
+            prefix += "font-style:italic;"
         if color:
-            html_item += f"color:{color};"
+            prefix += f"color:{color};"
         else: # Otherwise color black
-            html_item += f"color:#000000;"
-        html_item += "'>" # Close style attribute and span tag
+            prefix += f"color:#000000;"
+        prefix += "'>" # Close style attribute and span tag
     else: # Assume no styling and color black (so that it won't be affected by bullet color)
-        html_item += "<span style='font-family:Calibri;color:#000000;'>" # Default Calibri and black font
-        
-        
-        
-    html_item += _convertMath(content, color=color, inline=True) # CONTENT ADDED HERE, add math conversion to all text elements that use genHtmlElement (could also add it durin instantiation but would have less control over it)
+        prefix += "<span style='font-family:Calibri;color:#000000;'>" # Default Calibri and black font
     
+    suffix = ""
     if style or color: # Have to close styling span 
-        html_item += "</span>"
+        suffix += "</span>"
         
     if li: # Will close automatically if there is a starting point 
-        html_item += "</li>\n"
-    return html_item
+        suffix += "</li>\n"
+    return prefix, suffix
 
 
 def _genHtmlRecursively(node: OENodePoint, 
                        fx_genHtml: Callable,
                        data_atr: str = "data",
                        bul_atr: str = "bullet_data",
-                       **kwargs) -> str:
+                       **kwargs) -> HtmlFragment:
     """Generates the HTML rendering of a node and all of its children recursively 
     using a HTML generating function and styling arguments
 
@@ -299,11 +592,11 @@ def _genHtmlRecursively(node: OENodePoint,
 
 
     Returns:
-        str: HTML str containing rendered root node and its children
+        HtmlFragment: HTML containing rendered root node and its children
     """
     # Main rendering logic (will be repeated during recursion)
     renderable_types = ["concept", "grouping", "standard"] # This filter applies on all instances of call, 
-    html_item = ""
+    html_item = HtmlFragment()
     if node.type in renderable_types and node.__getattribute__(data_atr).strip() != "": # Only render text type and not whitespace
         html_item += fx_genHtml(node.__getattribute__(data_atr), bullet=node.__getattribute__(bul_atr), **kwargs) # Defaults to rendering node.data and node.bullet_data     
            
@@ -312,183 +605,132 @@ def _genHtmlRecursively(node: OENodePoint,
         children_nodes = node.children_nodes # Convert each child node into OENodePoint
         has_renderable_children = any([cnode.type in renderable_types for cnode in children_nodes]) # Checks types of children nodes to see if they are renderable
         if has_renderable_children:
-            html_children = "\n<ul>\n" # Open list
+            html_children = HtmlFragment("\n<ul>\n") # Open list
             for child_node in children_nodes:
                 html_children += _genHtmlRecursively(child_node, fx_genHtml, **kwargs) # Use same func and arguments as root since same type and same context 
             html_children += "</ul>\n" # Close list
-            html_item = _insertSubstring(html_item, "</li>", html_children) # Insert children into last item 
+            html_item = _nestHtml(html_item, html_children) # Insert children into last item 
     return html_item
 
 ## Special rendering functions
-
-def _renderCloze(node: OENodePoint, front: bool, level: str, renderer: StandardRenderer, root: bool = True) -> str:
-    if front:
-        if level == "entry":
-            return _renderGrouping(node, front, level, renderer, root=False) # root=False to avoid re-running renderOptions()
-        elif level == "direct_child":
-            indicators = "".join(node.indicators)            
-            return _genHtmlElement(f"{indicators} |____:", ["underline"], li=True, bullet=node.bullet_data) # Add colon for prompting
-        elif level == "sibling":
-            return _renderGrouping(node, front, level, renderer, root=False) # root=False to avoid re-running renderOptions()
-
-    else: # Functions for rendering backside
-        if level == "entry":
-            return _renderGrouping(node, front, level, renderer, root=False) # root=False to avoid re-running renderOptions()
-        elif level == "direct_child":
-            text_styled = _genHtmlElement(node.stem, ["underline"], "") + _genHtmlElement(node.body, [], GRAY) # Style stem and body differently
-            return _genHtmlElement(text_styled, [], "", li=True, bullet=node.bullet_data) # Create a greyed list item using styled text
-        elif level == "sibling":
-            return _renderGrouping(node, front, level, renderer, root=False) # root=False to avoid re-running renderOptions()
-
-
-def _renderListed(node: OENodePoint, front: bool, level: str, renderer: StandardRenderer, root: bool = True) -> str:
-    if front:
-        if level == "entry":
-            return _renderGrouping(node, front, level, renderer, root=False) # root=False to avoid re-running renderOptions()
-        elif level == "direct_child":
-            # Render like it is a entry level grouping, should probably refactor with main rendering function
-            front_render = _renderGrouping(node, front, "entry", renderer, root=False) # root=False to avoid re-running renderOptions()
-            # Render children nodes manually
-            if node.children_nodes: # Render direct children nodes
-                child_front = "\n<ul>\n" # Open list for direct children nodes
-                for child_node in node.children_nodes: 
-                    cfunc = FUNCMAP[child_node.type] # Refetch relevant function for child node (otherwise will use parent type)
-                    child_front += cfunc(node=child_node, front=front, level="direct_child", renderer=renderer)
-                child_front += "</ul>\n" # Close list for direct children nodes
-                front_render = _insertSubstring(front_render, "</li>", child_front)
-                
-            return front_render
-            return _genHtmlElement(node.stem + ":", ["underline"], li=True, bullet=node.bullet_data) # Actual code from renderGrouping
-        elif level == "sibling":
-            return _renderGrouping(node, front, level, renderer, root=False) # root=False to avoid re-running renderOptions()
-
-    else: # Functions for rendering backside
-        if level == "entry":
-            return _renderGrouping(node, front, level, renderer, root=False) # root=False to avoid re-running renderOptions()
-        elif level == "direct_child":
-            # Render like it is a entry level grouping, should probably refactor with main rendering function
-            back = _renderGrouping(node, front, "entry", renderer, root=False) # root=False to avoid re-running renderOptions()
-            # Render children nodes manually
-            if node.children_nodes: # Render direct children nodes
-                child_back = "\n<ul>\n" # Open list for direct children nodes
-                for child_node in node.children_nodes: 
-                    cfunc = FUNCMAP[child_node.type] # Refetch relevant function for child node (otherwise will use parent type)
-                    child_back += cfunc(node=child_node, front=front, level="direct_child", renderer=renderer)
-                child_back += "</ul>\n" # Close list for direct children nodes
-                back = _insertSubstring(back, "</li>", child_back)
-                
-            return back
-            # Below is code for only showing "(+)" prefix to node
-            text = bool(node.children_nodes)*"(+)" + node.data # Branchless adding of children prefix 
-            return _genHtmlElement(text, [], "", li=True, bullet=node.bullet_data) # No formatting
-        elif level == "sibling":
-            return _renderGrouping(node, front, level, renderer, root=False) # root=False to avoid re-running renderOptions()
-
-
-def _renderOptions(node: OENodePoint, front: bool, level: str, renderer: StandardRenderer) -> str:
+# Each rendering function returns the front and back rendering of a node together so that a single call covers both sides
+
+RenderPair = tuple[Union[str, HtmlFragment], Union[str, HtmlFragment]] # (front, back)
+
+def _renderCloze(node: OENodePoint, level: str, renderer: StandardRenderer) -> RenderPair:
+    if level == "entry":
+        return _renderGrouping(node, level, renderer) # Fall back to standard grouping rendering
+    elif level == "direct_child":
+        indicators = "".join(node.indicators)            
+        front = _genHtmlElement(f"{indicators} |____:", ["underline"], li=True, bullet=node.bullet_data, compact=renderer.compact) # Add colon for prompting
+        text_styled = _genHtmlElement(node.stem, ["underline"], "", compact=renderer.compact) + _genHtmlElement(node.body, [], GRAY, compact=renderer.compact) # Style stem and body differently
+        back = _genHtmlElement(text_styled, [], "", li=True, bullet=node.bullet_data, compact=renderer.compact) # Create a greyed list item using styled text
+        return front, back
+    elif level == "sibling":
+        return _renderGrouping(node, level, renderer) # Fall back to standard grouping rendering
+
+
+def _renderListed(node: OENodePoint, level: str, renderer: StandardRenderer) -> RenderPair:
+    if level == "entry":
+        return _renderGrouping(node, level, renderer) # Fall back to standard grouping rendering
+    elif level == "direct_child":
+        # Render like it is a entry level grouping, should probably refactor with main rendering function
+        front, back = _renderGrouping(node, "entry", renderer) # Fall back to standard grouping rendering
+        front, back = HtmlFragment(front), HtmlFragment(back)
+        # Render children nodes manually
+        if node.children_nodes: # Render direct children nodes
+            child_front = HtmlFragment("\n<ul>\n") # Open list for direct children nodes
+            child_back = HtmlFragment("\n<ul>\n")
+            for child_node in node.children_nodes: 
+                cfront, cback = renderer.renderNode(child_node, level="direct_child")
+                child_front += cfront
+                child_back += cback
+            child_front += "</ul>\n" # Close list for direct children nodes
+            child_back += "</ul>\n"
+            front = _nestHtml(front, child_front)
+            back = _nestHtml(back, child_back)
+        return front, back
+        # Below is code for only showing "(+)" prefix to node
+        text = bool(node.children_nodes)*"(+)" + node.data # Branchless adding of children prefix 
+        return _genHtmlElement(node.stem + ":", ["underline"], li=True, bullet=node.bullet_data, compact=renderer.compact), _genHtmlElement(text, [], "", li=True, bullet=node.bullet_data, compact=renderer.compact) # No formatting
+    elif level == "sibling":
+        return _renderGrouping(node, level, renderer) # Fall back to standard grouping rendering
+
+
+def _resolveRenderFunc(node: OENodePoint) -> Callable:
+    """
+    Picks the rendering function of a node based on its type and, for concept and grouping nodes, on its indicators
+    Resolved once per node by StandardRenderer.renderNode(), rendering functions never re-check options
+    """
     # SHould use only flags rather than indicators (which are used to generate flags)
-    if "H" in node.indicators: # Top priority render option
-        return _ignoreNode(node, front, level, renderer)
-    if {"C", "L"}.intersection(set(node.indicators)): # Pass arguments onto special rendering functions if there's overlap b/n indicators of interest and node indicators 
+    func = FUNCMAP[node.type] # Retrieve relevant function based on node type
+    if func in [_renderConcept, _renderGrouping]: # Only these types support rendering options
+        if "H" in node.indicators: # Top priority render option
+            return _ignoreNode
         if "C" in node.indicators:
-            return _renderCloze(node, front, level, renderer)
+            return _renderCloze
         if "L" in node.indicators:
-            return _renderListed(node, front, level, renderer)
-    else:
-        return False
+            return _renderListed
+    return func
 
 ## Standard rendering functions
 
-def _renderConcept(node: OENodePoint, front: bool, level: str, renderer: StandardRenderer, root: bool = True) -> str:
-    """
-    root: Keeps track if the current instance of the call is from the root (i.e., call should check for options), 
-    otherwise it will skip extra options and go straight to default method. Used for recursively falling back 
-    to default options from a special rendering option (i.e., reuse a standard rendering function when certain 
-    criteria are met)
-    """
-    if root and _renderOptions(node, front, level, renderer) != False: # Will only return true if node.indicators contain rendering options and has not previously called renderOptions, explicitly check if False
-        # Note that root must be evaluated first, otherwise will try to evaluate function and enter infinite recursion
-        # Not actually implemented in Concept-type nodes yet
-        return _renderOptions(node, front, level, renderer) # Use output from renderOptions() instead if applicable, otherwise go through default
-    elif front:
-        if level == "entry":
-            return _genHtmlElement("【" + node.stem + "】", ["bold"], li=True, bullet=node.bullet_data) # Add unformatted colon for prompting
-        elif level == "direct_child":
-            if node.isEmptyChildless(): # If empty and has no children, do not render
-                return ""
-            return _genHtmlElement("____:", ["bold"], li=True, bullet=node.bullet_data) # Add unformatted colon for prompting
-        elif level == "sibling":
-            if node.isEmptyChildless(): # If empty and has no children, do not render
-                return ""
-            return _genHtmlElement(node.stem, ["bold"], GRAY, li=True, bullet=node.bullet_data) 
-
-    else: # Functions for rendering backside
-        if level == "entry":
-            return _genHtmlElement("【" + node.data + "】", li=True, bullet=node.bullet_data) # Convert to list item but keep raw data
-        elif level == "direct_child":
-            if node.isEmptyChildless(): # If empty and has no children, do not render
-                return ""
-            text_styled = _genHtmlElement(node.stem, ["bold"], "") + _genHtmlElement(node.body, [], GRAY) # Style stem and body differently
-            return _genHtmlElement(text_styled, [], "", li=True, bullet=node.bullet_data) # Wrap styled text in list tags
-        elif level == "sibling":
-            if node.isEmptyChildless(): # If empty and has no children, do not render
-                return ""
-            text = bool(node.children_nodes)*"(+)" + node.data # Branchless adding of children prefix 
-            return _genHtmlElement(text, [], GRAY, li=True, bullet=node.bullet_data) 
-
-
-def _renderGrouping(node: OENodePoint, front: bool, level: str, renderer: StandardRenderer, root: bool = True) -> str:
-    if root and _renderOptions(node, front, level, renderer) != False: # Will only return true if node.indicators contain rendering options, explicitly check False
-        # Note that root must be evaluated first, otherwise will try to evaluate function and enter infinite recursion
-        return _renderOptions(node, front, level, renderer) # Use output from renderOptions() instead if applicable, otherwise go through default
-    if front:
-        if level == "entry":
-            return _genHtmlElement("【" + node.stem + ":】", ["underline"], li=True, bullet=node.bullet_data) # Add colon for prompting
-        elif level == "direct_child":
-            return "" # Ignore regular Grouping-type nodes
-        elif level == "sibling":
-            if node.isEmptyChildless(): # If empty and has no children, do not render
-                return ""
-            return _genHtmlElement(node.stem, ["underline"], GRAY, li=True, bullet=node.bullet_data) 
-
-    else: # Functions for rendering backside
-        if level == "entry":
-            return _genHtmlElement("【" + node.data + "】", li=True, bullet=node.bullet_data) # Convert to list item but keep raw data
-        elif level == "direct_child":
-            if node.isEmptyChildless(): # If empty and has no children, do not render
-                return ""
-            text = bool(node.children_nodes)*"(+)" + node.data # Branchless adding of children prefix 
-            return _genHtmlElement(text, [], GRAY, li=True, bullet=node.bullet_data) 
-        elif level == "sibling":
-            if node.isEmptyChildless(): # If empty and has no children, do not render
-                return ""
-            text = bool(node.children_nodes)*"(+)" + node.data # Branchless adding of children prefix 
-            return _genHtmlElement(text, [], GRAY, li=True, bullet=node.bullet_data) 
-
-
-def _renderNormalText(node: OENodePoint, front: bool, level: str, renderer: StandardRenderer, root: bool = True) -> str:
-    if front:
-        if level == "entry":
-            return "" # Shouldn't have normal text as entry point
-        elif level == "direct_child":
-            return _genHtmlElement("Subpoint", ["italic"], li=True, bullet=node.bullet_data) # Italicized placeholder
-        elif level == "sibling":
-            return "" # Ignore
-
-    else: # Functions for rendering backside
-        if level == "entry":
-            return "" # Shouldn't have normal text as entry point
-        elif level == "direct_child":
-            return _genHtmlRecursively(node, _genHtmlElement, style=[], color="", li=True) # Render node and children with original format
-        elif level == "sibling":
-            return _genHtmlRecursively(node, _genHtmlElement, style=[], color=GRAY, li=True)
-
-
-def _renderImage(node: OENodePoint, front: bool, level: str, renderer: StandardRenderer, root: bool = True) -> str:
+def _renderConcept(node: OENodePoint, level: str, renderer: StandardRenderer) -> RenderPair:
+    if level == "entry":
+        front = _genHtmlElement("【" + node.stem + "】", ["bold"], li=True, bullet=node.bullet_data, compact=renderer.compact) # Add unformatted colon for prompting
+        back = _genHtmlElement("【" + node.data + "】", li=True, bullet=node.bullet_data, compact=renderer.compact) # Convert to list item but keep raw data
+        return front, back
+    elif level == "direct_child":
+        if node.isEmptyChildless(): # If empty and has no children, do not render
+            return "", ""
+        front = _genHtmlElement("____:", ["bold"], li=True, bullet=node.bullet_data, compact=renderer.compact) # Add unformatted colon for prompting
+        text_styled = _genHtmlElement(node.stem, ["bold"], "", compact=renderer.compact) + _genHtmlElement(node.body, [], GRAY, compact=renderer.compact) # Style stem and body differently
+        back = _genHtmlElement(text_styled, [], "", li=True, bullet=node.bullet_data, compact=renderer.compact) # Wrap styled text in list tags
+        return front, back
+    elif level == "sibling":
+        if node.isEmptyChildless(): # If empty and has no children, do not render
+            return "", ""
+        front = _genHtmlElement(node.stem, ["bold"], GRAY, li=True, bullet=node.bullet_data, compact=renderer.compact) 
+        text = bool(node.children_nodes)*"(+)" + node.data # Branchless adding of children prefix 
+        back = _genHtmlElement(text, [], GRAY, li=True, bullet=node.bullet_data, compact=renderer.compact) 
+        return front, back
+
+
+def _renderGrouping(node: OENodePoint, level: str, renderer: StandardRenderer) -> RenderPair:
+    if level == "entry":
+        front = _genHtmlElement("【" + node.stem + ":】", ["underline"], li=True, bullet=node.bullet_data, compact=renderer.compact) # Add colon for prompting
+        back = _genHtmlElement("【" + node.data + "】", li=True, bullet=node.bullet_data, compact=renderer.compact) # Convert to list item but keep raw data
+        return front, back
+    elif level == "direct_child":
+        if node.isEmptyChildless(): # If empty and has no children, do not render
+            return "", ""
+        text = bool(node.children_nodes)*"(+)" + node.data # Branchless adding of children prefix 
+        return "", _genHtmlElement(text, [], GRAY, li=True, bullet=node.bullet_data, compact=renderer.compact) # Ignore regular Grouping-type nodes on front
+    elif level == "sibling":
+        if node.isEmptyChildless(): # If empty and has no children, do not render
+            return "", ""
+        front = _genHtmlElement(node.stem, ["underline"], GRAY, li=True, bullet=node.bullet_data, compact=renderer.compact) 
+        text = bool(node.children_nodes)*"(+)" + node.data # Branchless adding of children prefix 
+        back = _genHtmlElement(text, [], GRAY, li=True, bullet=node.bullet_data, compact=renderer.compact) 
+        return front, back
+
+
+def _renderNormalText(node: OENodePoint, level: str, renderer: StandardRenderer) -> RenderPair:
+    if level == "entry":
+        return "", "" # Shouldn't have normal text as entry point
+    elif level == "direct_child":
+        front = _genHtmlElement("Subpoint", ["italic"], li=True, bullet=node.bullet_data, compact=renderer.compact) # Italicized placeholder
+        back = _genHtmlRecursively(node, _genHtmlElement, style=[], color="", li=True, compact=renderer.compact) # Render node and children with original format
+        return front, back
+    elif level == "sibling":
+        return "", _genHtmlRecursively(node, _genHtmlElement, style=[], color=GRAY, li=True, compact=renderer.compact) # Ignore on front
+
+
+def _renderImage(node: OENodePoint, level: str, renderer: StandardRenderer) -> RenderPair:
     def _genImageName(node: OENodePoint) -> str:
         re_punct = re.compile('[\W_]+') # Regexp that matches any non-alphanumeric
         title = node.parent_headers[0].page_title # Use first node's page title
-        img_name = re_punct.sub("", title)[:30] # Instantiate img_name string with first 30 chars of title (with punct removed)
+        img_name = IMG_PREFIX + re_punct.sub("", title)[:30] # Instantiate img_name string with first 30 chars of title (with punct removed)
         for h_node in node.parent_headers:
             img_name += re_punct.sub("", h_node.text)[:20] # Add first 20 chars of each header to img_name
         for p_node in node.parent_nodes: # Should only have Concept and Grouping-type nodes as parents
@@ -497,88 +739,47 @@ def _renderImage(node: OENodePoint, front: bool, level: str, renderer: StandardR
         return img_name[:190] # Return first 190 characters - Windows allows for 255 max characters for absolute path, give ~60 chars for dir path
         # Media folder (60 characters): C:\Users\steve\AppData\Roaming\Anki2\User 1\collection.media
     
-    if front:
-        if level == "entry":
-            return "" # Shouldn't have image as entry point, unless there's a specific function (e.g., name this picture)
-        elif level == "direct_child":
-            return _genHtmlElement("Image", ["italic"], li=True, bullet=node.bullet_data) # Italicized placeholder
-        elif level == "sibling":
-            return "" # Ignore
-
-    else: # Functions for rendering backside
-        if level == "entry":
-            return "" # Shouldn't have image as entry point, unless there's a specific function (e.g., name this picture)
-        elif level == "direct_child":
-            renderer.img_count_child += 1
-            img_name = _genImageName(node) + str(renderer.img_count_child) + ".png" # Append img_count to make it a unique name
-        elif level == "sibling":
-            renderer.img_count_sibling += 1
-            img_name = _genImageName(node) + str(renderer.img_count_sibling) + ".png" 
-        
-        # Common image generation path
-        img_path = os.path.join(MPATH, img_name)
-        img_data_bytes = node.data.encode("utf-8")
-        with open(img_path, "wb") as file:
-            file.write(base64.decodebytes(img_data_bytes)) # Convert bytes format to base64 format which is read by write() functio
-        return _genHtmlElement(f"<img src='{img_name}' {IMG_STYLING}>", [], "", li=True, bullet=node.bullet_data)
-
-
-def _renderEquation(node: OENodePoint, front: bool, level: str, renderer: StandardRenderer, root: bool = True) -> str:
-
-    if front:
-        if level == "entry":
-            return "" # Shouldn't have equation as entry point
-        elif level == "direct_child":
-            return _genHtmlElement("Equation", ["italic"], li=True, bullet=node.bullet_data) # Italicized placeholder
-        elif level == "sibling":
-            return "" # Ignore
-
-    else: # Functions for rendering backside
-        if level == "entry":
-            return "" # Shouldn't have equation as entry point
-        elif level == "direct_child":
-            math_tex = _convertMath(node.data, color="", inline=False)
-            return _genHtmlElement(math_tex, [], li=True, bullet=node.bullet_data)
-        elif level == "sibling":
-            math_tex = _convertMath(node.data, color="", inline=False)
-            return _genHtmlElement(math_tex, [], li=True, bullet=node.bullet_data)
+    if level == "entry":
+        return "", "" # Shouldn't have image as entry point, unless there's a specific function (e.g., name this picture)
+    elif level == "direct_child":
+        front = _genHtmlElement("Image", ["italic"], li=True, bullet=node.bullet_data, compact=renderer.compact) # Italicized placeholder
+    elif level == "sibling":
+        front = "" # Ignore
+    
+    # Number images by position among image siblings rather than per card, cards with different sibling windows then agree on names
+    img_num = [n for n in node.sibling_nodes if n.type == "image"].index(node) + 1
+    img_name = _genImageName(node) + str(img_num) + ".png" # Append img_num to make it a unique name
+    
+    # Common image generation path
+    img_src = renderer.media.store(img_name, node.data) # Sink decides where image goes and how it is referenced
+    img_styling = "" if renderer.compact else " " + IMG_STYLING # Compact styling is provided by note type CSS
+    return front, _genHtmlElement(f"<img src='{img_src}'{img_styling}>", [], "", li=True, bullet=node.bullet_data, compact=renderer.compact)
+
+
+def _renderEquation(node: OENodePoint, level: str, renderer: StandardRenderer) -> RenderPair:
+    if level == "entry":
+        return "", "" # Shouldn't have equation as entry point
+    elif level == "direct_child":
+        front = _genHtmlElement("Equation", ["italic"], li=True, bullet=node.bullet_data, compact=renderer.compact) # Italicized placeholder
+        math_tex = _convertMath(node.data, color="", inline=False)
+        return front, _genHtmlElement(math_tex, [], li=True, bullet=node.bullet_data, compact=renderer.compact)
+    elif level == "sibling":
+        math_tex = _convertMath(node.data, color="", inline=False)
+        return "", _genHtmlElement(math_tex, [], li=True, bullet=node.bullet_data, compact=renderer.compact) # Ignore on front
         
         
 
-def _renderTable(node: OENodePoint, front: bool, level: str, renderer: StandardRenderer, root: bool = True) -> str:
-    if front:
-        if level == "entry":
-            return "" # Shouldn't have table as entry point in standard renderer
-        elif level == "direct_child":
-            return "" # Ignore
-        elif level == "sibling":
-            return "" # Ignore
-
-    else: # Functions for rendering backside
-        if level == "entry":
-            return "" # Shouldn't have table as entry point in standard renderer
-        elif level == "direct_child":
-            return _genHtmlElement("Table", ["italic"], li=True, bullet=node.bullet_data) # Italicized placeholder
-        elif level == "sibling":
-            return _genHtmlElement("Table", ["italic"], li=True, bullet=node.bullet_data) # Italicized placeholder
-
-
-def _ignoreNode(node: OENodePoint, front: bool, level: str, renderer: StandardRenderer, root: bool = True) -> str:
-    if front:
-        if level == "entry":
-            return ""
-        elif level == "direct_child":
-            return ""
-        elif level == "sibling":
-            return ""
-
-    else: # Functions for rendering backside
-        if level == "entry":
-            return ""
-        elif level == "direct_child":
-            return ""
-        elif level == "sibling":
-            return ""
+def _renderTable(node: OENodePoint, level: str, renderer: StandardRenderer) -> RenderPair:
+    if level == "entry":
+        return "", "" # Shouldn't have table as entry point in standard renderer
+    elif level == "direct_child":
+        return "", _genHtmlElement("Table", ["italic"], li=True, bullet=node.bullet_data, compact=renderer.compact) # Italicized placeholder, ignore on front
+    elif level == "sibling":
+        return "", _genHtmlElement("Table", ["italic"], li=True, bullet=node.bullet_data, compact=renderer.compact) # Italicized placeholder, ignore on front
+
+
+def _ignoreNode(node: OENodePoint, level: str, renderer: StandardRenderer) -> RenderPair:
+    return "", "" # Same for all levels
 
 
 FUNCMAP = {
@@ -0,0 +1,23 @@
+#%% Adding cards through AnkiConnect, against the local stub instead of a running Anki
+from anki_api import ProtoNote, addCardsViaAnkiConnect
+from ankiconnect_stub import AnkiConnectStub
+
+IMG_NAME = "autogen_Test1.png"
+notes = [ProtoNote(f"Front {ind}", f"Back {ind}<img src='{IMG_NAME}'>", deck="Test::Deck", tags=["t"]) for ind in range(1200)]
+
+with AnkiConnectStub() as stub:
+    note_ids = addCardsViaAnkiConnect(notes, media={IMG_NAME: b"png"}, url=stub.url)
+    assert None not in note_ids and len(stub.notes) == len(notes), len(stub.notes)
+    assert stub.media == {IMG_NAME: b"png"}
+    assert {"Test", "Test::Deck"} <= stub.decks
+    assert stub.connections == 1, stub.connections # Keep-alive connection is reused for every batch
+
+    #%% Replacing removes earlier auto notes of target decks instead of adding to them
+    addCardsViaAnkiConnect(iter(notes), replace=True, url=stub.url) # Any iterable, e.g., notes still rendering
+    assert len(stub.notes) == len(notes), len(stub.notes)
+    assert all(note["tags"] == ["Auto", "t"] for note in stub.notes.values())
+
+    #%% Replacing a parent deck in a later batch keeps notes just added to its subdeck
+    addCardsViaAnkiConnect(notes + [ProtoNote("Parent", "Back", deck="Test")], replace=True, url=stub.url)
+    assert len(stub.notes) == len(notes) + 1, len(stub.notes)
+print("AnkiConnect OK")
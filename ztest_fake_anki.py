@@ -0,0 +1,38 @@
+#%% Adding cards on the fake backend, see fake_anki.FakeCollection
+from anki_api import ProtoNote, addCardsFromNotes, noteGuid, ADD_BATCH
+from fake_anki import FakeCollection
+
+def deckCount(col: FakeCollection, deck: str) -> int:
+    return len(col.find_notes(F'tag:Auto "deck:{deck}" -"deck:{deck}::*"'))
+
+col = FakeCollection()
+
+#%% Replacing a parent deck in a later batch keeps notes just added to its subdeck
+child = [ProtoNote(f"Child {ind}", "Back", deck="Sec::Physiology::Cardiac") for ind in range(ADD_BATCH)]
+parent = [ProtoNote(f"Parent {ind}", "Back", deck="Sec::Physiology") for ind in range(2)]
+for _ in range(2): # Second run replaces notes of the first one
+    addCardsFromNotes(iter(child + parent), replace=True, col_open=col)
+    assert deckCount(col, "Sec::Physiology::Cardiac") == ADD_BATCH, deckCount(col, "Sec::Physiology::Cardiac")
+    assert deckCount(col, "Sec::Physiology") == 2, deckCount(col, "Sec::Physiology")
+    assert col.note_count() == ADD_BATCH + 2, col.note_count()
+col.close()
+
+#%% Adding again without replace keeps GUIDs unique, replacing keeps stable ones
+col = FakeCollection()
+notes = [ProtoNote(f"Front {ind}", "Back", deck="Guid", guid=noteGuid(str(ind))) for ind in range(10)]
+addCardsFromNotes(notes, col_open=col)
+addCardsFromNotes(notes, col_open=col)
+guids = col.db.list("select guid from notes")
+assert len(guids) == len(set(guids)) == 2 * len(notes), len(set(guids))
+addCardsFromNotes(notes, replace=True, col_open=col)
+assert sorted(col.db.list("select guid from notes")) == sorted(note.guid for note in notes)
+
+#%% Images are registered with the first batch referencing them, then released
+media = {F"autogen_Img{ind}.png": b"png" + bytes([ind]) for ind in range(3)}
+notes = [ProtoNote(f"Front {ind}", f"<img src='autogen_Img{ind % 3}.png'>", deck="Media") for ind in range(ADD_BATCH + 1)]
+addCardsFromNotes(iter(notes), col_open=col, media=media, release_media=True)
+assert media == {}, media
+assert all(col.media.have(F"autogen_Img{ind}.png") for ind in range(3))
+
+col.close()
+print("Fake backend OK")
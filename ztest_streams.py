@@ -0,0 +1,39 @@
+#%% Note streams written while rendering, see CardGenerator.writeJsonl() and genStreams()
+import os, json, tempfile
+
+from cardgenerator import CardGenerator, genStreams
+from renderer import BufferedMediaSink
+
+XML_PAGE_PATH = os.path.join("data", "page_xml.xml") # Page with 3 images
+XML_OUTL_PATH = os.path.join("data", "outline_xml.xml")
+
+def countRecords(stream_path: str) -> dict[str, int]:
+    counts = {}
+    with open(stream_path, encoding="utf-8") as file:
+        for line in file:
+            record_type = json.loads(line)["type"]
+            counts[record_type] = counts.get(record_type, 0) + 1
+    return counts
+
+out_dir = tempfile.mkdtemp()
+
+#%% Streamed write, images are only stored by the sink once their note renders
+crawler = CardGenerator(XML_PAGE_PATH, XML_OUTL_PATH, media=BufferedMediaSink())
+crawler.writeJsonl(os.path.join(out_dir, "streamed.jsonl"), crawler.iterNotes())
+streamed = countRecords(os.path.join(out_dir, "streamed.jsonl"))
+print(streamed)
+assert streamed["media"] == 3, streamed
+
+#%% Same records as writing after rendering everything
+crawler = CardGenerator(XML_PAGE_PATH, XML_OUTL_PATH, media=BufferedMediaSink()).genNotes()
+crawler.writeJsonl(os.path.join(out_dir, "rendered.jsonl"))
+assert countRecords(os.path.join(out_dir, "rendered.jsonl")) == streamed
+
+
+#%% Batch streams keep images of each page, guarded since worker processes can re-import this script
+if __name__ == "__main__":
+    stream_paths = genStreams([XML_PAGE_PATH, XML_PAGE_PATH], XML_OUTL_PATH, os.path.join(out_dir, "streams"), workers=2)
+    assert len(stream_paths) == 2
+    for stream_path in stream_paths:
+        assert countRecords(stream_path) == streamed, stream_path
+print("Streams OK")